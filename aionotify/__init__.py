@@ -1,13 +1,43 @@
 # Copyright (c) 2016 The aionotify project
 # This code is distributed under the two-clause BSD License.
 
-from importlib.metadata import version
+"""asyncio-based inotify bindings.
+
+Importing aionotify must stay cheap, for short-lived tools: modules only some
+features need (ctypes and libc, hashlib, json, distribution metadata) are
+imported by the functions using them, on first use.
+"""
 
 from .enums import Flags
+from .events import Event, Rename
 from .base import Watcher
+from .dispatch import Dispatcher, Subscription
+from .sharded import ShardedWatcher
+from .sync import SyncWatcher
+from .replay import ReplayWatcher
 
-__all__ = ['Flags', 'Watcher']
+__all__ = [
+    'Dispatcher',
+    'Event',
+    'Flags',
+    'Rename',
+    'ReplayWatcher',
+    'ShardedWatcher',
+    'Subscription',
+    'SyncWatcher',
+    'Watcher',
+]
 
 
-__version__ = version("aionotify")
 __author__ = 'Raphaël Barrois <raphael.barrois+aionotify@polytechnique.org>'
+
+
+def __getattr__(name):
+    # Looking up the installed version scans distributions: only do it on demand.
+    if name == '__version__':
+        from importlib.metadata import version
+
+        global __version__
+        __version__ = version("aionotify")
+        return __version__
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
@@ -3,22 +3,32 @@
 
 import asyncio
 import asyncio.futures
+import collections
 import errno
 import logging
 import os
+import time
 
 logger = logging.getLogger('asyncio.aionotify')
 
 
 class UnixFileDescriptorTransport(asyncio.ReadTransport):
     # Inspired from asyncio.unix_events._UnixReadPipeTransport
-    max_size = 1024
+    max_size = 65536
 
-    def __init__(self, loop, fileno, protocol, waiter=None):
+    def __init__(self, loop, fileno, protocol, waiter=None, max_size=None, stats=None, recorder=None):
         super().__init__()
         self._loop = loop
         self._fileno = fileno
         self._protocol = protocol
+        if max_size is not None:
+            self.max_size = max_size
+        #: Optional aionotify.stats.Stats, recording each read
+        self.stats = stats
+        #: Optional aionotify.record.Recorder, logging the bytes of each read
+        self.recorder = recorder
+        # Buffered protocols get the kernel data read straight into their own buffer.
+        self._buffered = isinstance(protocol, asyncio.BufferedProtocol)
 
         self._active = False
         self._closing = False
@@ -37,9 +47,13 @@ class UnixFileDescriptorTransport(asyncio.ReadTransport):
     def _read_ready(self):
         """Called by the event loop whenever the fd is ready for reading."""
 
+        if self._buffered:
+            self._readinto()
+            return
+
         try:
             data = os.read(self._fileno, self.max_size)
-        except InterruptedError:
+        except (BlockingIOError, InterruptedError):
             # No worries ;)
             pass
         except OSError as exc:
@@ -47,15 +61,43 @@ class UnixFileDescriptorTransport(asyncio.ReadTransport):
             self._fatal_error(exc, "Fatal read error on file descriptor read")
         else:
             if data:
+                if self.stats is not None:
+                    self.stats.record_read(len(data))
+                if self.recorder is not None:
+                    self.recorder.record_read(data)
                 self._protocol.data_received(data)
             else:
                 # We reached end-of-file.
-                if self._loop.get_debug():
-                    logger.info("%r was closed by the kernel", self)
-                self._closing = False
-                self.pause_reading()
-                self._loop.call_soon(self._protocol.eof_received)
-                self._loop.call_soon(self._call_connection_lost, None)
+                self._eof()
+
+    def _readinto(self):
+        """Read into the protocol's buffer, avoiding a copy per read."""
+        try:
+            buf = self._protocol.get_buffer(-1)
+            nbytes = os.readv(self._fileno, [buf])
+        except (BlockingIOError, InterruptedError):
+            # Spurious wakeup on a non-blocking fd, or a signal.
+            pass
+        except OSError as exc:
+            self._fatal_error(exc, "Fatal read error on file descriptor read")
+        else:
+            if nbytes:
+                if self.stats is not None:
+                    self.stats.record_read(nbytes)
+                if self.recorder is not None:
+                    self.recorder.record_read(memoryview(buf)[:nbytes])
+                self._protocol.buffer_updated(nbytes)
+            else:
+                # We reached end-of-file.
+                self._eof()
+
+    def _eof(self):
+        if self._loop.get_debug():
+            logger.info("%r was closed by the kernel", self)
+        self._closing = False
+        self.pause_reading()
+        self._loop.call_soon(self._protocol.eof_received)
+        self._loop.call_soon(self._call_connection_lost, None)
 
     def pause_reading(self):
         """Public API: pause reading the transport."""
@@ -119,10 +161,196 @@ class UnixFileDescriptorTransport(asyncio.ReadTransport):
         return '<%s>' % ' '.join(parts)
 
 
-async def stream_from_fd(fd, loop):
-    """Recieve a streamer for a given file descriptor."""
-    reader = asyncio.StreamReader(loop=loop)
-    protocol = asyncio.StreamReaderProtocol(reader, loop=loop)
+def pop_events(queue, max_events=None):
+    """Pop up to ``max_events`` events from the left of a deque (all by default), as a list."""
+    if max_events is None or max_events >= len(queue):
+        events = list(queue)
+        queue.clear()
+        return events
+    return [queue.popleft() for _i in range(max_events)]
+
+
+#: Policies for a full event queue
+QUEUE_BLOCK = 'block'  #: Stop reading from the kernel until the queue is drained below the low-water mark
+QUEUE_DROP_OLDEST = 'drop-oldest'  #: Drop the oldest events
+QUEUE_COALESCE = 'coalesce'  #: Merge queued events for the same name, then block if still full
+QUEUE_POLICIES = (QUEUE_BLOCK, QUEUE_DROP_OLDEST, QUEUE_COALESCE)
+
+
+class InotifyProtocol(asyncio.BufferedProtocol):
+    """Decode inotify records as they are read, and queue the resulting events.
+
+    ``decode`` is called with each raw buffer read from the kernel, and must
+    return a list of events; it must not keep a reference to that buffer,
+    which is reused across reads.
+
+    If ``high_water`` is set, ``policy`` tells what to do once that many events
+    are queued; reading from the kernel resumes once the queue holds at most
+    ``low_water`` events.
+
+    With ``stats``, an aionotify.stats.Stats, queue depth and delivery latency are recorded.
+
+    With ``timestamps``, decoded events get the monotonic time of the read that
+    returned them in their ``timestamp``, taken when the transport asks for a
+    buffer; ``trace``, if set, is called as ``trace('read', time, nbytes)``
+    and ``trace('decode', time, events)`` for each read.
+    """
+
+    def __init__(
+            self, decode, loop, buffer_size=65536, high_water=None, low_water=None, policy=QUEUE_BLOCK, stats=None,
+            timestamps=False, trace=None):
+        self._decode = decode
+        self._loop = loop
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._transport = None
+        self._waiter = None
+        self._closed = False
+        self._paused = False
+        self.high_water = high_water
+        self.low_water = high_water // 2 if low_water is None and high_water is not None else low_water
+        self.policy = policy
+        #: Number of events dropped by the QUEUE_DROP_OLDEST policy
+        self.dropped = 0
+        self.events = collections.deque()
+        self.stats = stats
+        # With stats: when the oldest queued event was read.
+        self._queued_at = None
+        self.timestamps = timestamps
+        self.trace = trace
+        self.clock = time.monotonic if timestamps or trace is not None else None
+        # With a clock: when the pending read started.
+        self._read_at = None
+
+    def connection_made(self, transport):
+        self._transport = transport
+
+    def get_buffer(self, sizehint):
+        if self.clock is not None:
+            self._read_at = self.clock()
+        return self._buffer
+
+    def buffer_updated(self, nbytes):
+        if self.clock is None:
+            self.feed_events(self._decode(self._view[:nbytes]))
+        else:
+            self._received(self._view[:nbytes], self._read_at)
+
+    def data_received(self, data):
+        if self.clock is None:
+            self.feed_events(self._decode(data))
+        else:
+            self._received(data, self.clock())
+
+    def _received(self, data, read_at):
+        """Decode a read, with timestamps or tracing."""
+        trace = self.trace
+        if trace is not None:
+            trace('read', read_at, len(data))
+        events = self._decode(data)
+        if self.timestamps:
+            for event in events:
+                event.timestamp = read_at
+        if trace is not None:
+            trace('decode', self.clock(), events)
+        self.feed_events(events)
+
+    def feed_events(self, events):
+        """Queue events, waking up the reader."""
+        if events:
+            stats = self.stats
+            if stats is not None and not self.events:
+                self._queued_at = stats.clock()
+            self.events.extend(events)
+            if self.high_water is not None and len(self.events) >= self.high_water:
+                self._queue_full()
+            if stats is not None:
+                stats.record_events(len(events), len(self.events))
+            self._wakeup_waiter()
+
+    def _queue_full(self):
+        if self.policy == QUEUE_DROP_OLDEST:
+            excess = len(self.events) - self.high_water
+            for _i in range(excess):
+                self.events.popleft()
+            self.dropped += excess
+            if self.stats is not None:
+                self.stats.record_queue_dropped(excess)
+            return
+
+        if self.policy == QUEUE_COALESCE:
+            merged = collections.OrderedDict()
+            for event in self.events:
+                key = (event.alias, event.raw_name)
+                previous = merged.get(key)
+                merged[key] = event if previous is None else previous._replace(flags=previous.flags | event.flags)
+            self.events = collections.deque(merged.values())
+            if len(self.events) < self.high_water:
+                return
+
+        # Leave further events in the kernel queue.
+        if self._transport is not None and not self._paused:
+            self._transport.pause_reading()
+            self._paused = True
+
+    def take(self, max_events=None):
+        """Pop up to ``max_events`` queued events (all by default)."""
+        queue = self.events
+        events = pop_events(queue, max_events)
+
+        stats = self.stats
+        if stats is not None and events:
+            # Latency of the oldest event of the batch; any remaining events
+            # keep that read time, an upper bound.
+            stats.record_delivery(len(events), stats.clock() - self._queued_at, len(queue))
+            if not queue:
+                self._queued_at = None
+
+        if self._paused and len(queue) <= self.low_water:
+            self._paused = False
+            if self._transport is not None:
+                self._transport.resume_reading()
+        return events
+
+    def eof_received(self):
+        self._closed = True
+        self._wakeup_waiter()
+
+    def connection_lost(self, exc):
+        self._closed = True
+        self._transport = None
+        self._wakeup_waiter()
+
+    def _wakeup_waiter(self):
+        waiter = self._waiter
+        if waiter is not None:
+            self._waiter = None
+            if not waiter.cancelled():
+                waiter.set_result(None)
+
+    def discard(self, predicate):
+        """Drop all queued events matching a predicate."""
+        self.events = collections.deque(event for event in self.events if not predicate(event))
+
+    @property
+    def closed(self):
+        return self._closed
+
+    async def wait(self):
+        """Wait until events are available, or the connection gets closed."""
+        if self.events or self._closed:
+            return
+        if self._waiter is not None:
+            raise RuntimeError("wait() called while another coroutine is already waiting for events")
+        self._waiter = self._loop.create_future()
+        try:
+            await self._waiter
+        finally:
+            self._waiter = None
+
+
+async def connect_fd(fd, protocol, loop, stats=None, recorder=None):
+    """Connect a protocol to a given file descriptor, and return the transport."""
     waiter = asyncio.futures.Future(loop=loop)
 
     transport = UnixFileDescriptorTransport(
@@ -130,6 +358,8 @@ async def stream_from_fd(fd, loop):
         fileno=fd,
         protocol=protocol,
         waiter=waiter,
+        stats=stats,
+        recorder=recorder,
     )
 
     try:
@@ -139,4 +369,12 @@ async def stream_from_fd(fd, loop):
 
     if loop.get_debug():
         logger.debug("Read fd %r connected: (%r, %r)", fd, transport, protocol)
+    return transport
+
+
+async def stream_from_fd(fd, loop):
+    """Recieve a streamer for a given file descriptor."""
+    reader = asyncio.StreamReader(loop=loop)
+    protocol = asyncio.StreamReaderProtocol(reader, loop=loop)
+    transport = await connect_fd(fd, protocol, loop)
     return reader, transport
@@ -3,99 +3,1111 @@
 
 import asyncio
 import collections
-import ctypes
+import errno
+import functools
+import inspect
+import logging
+import math
+import os
 import struct
+import time
 
 from . import aioutils
+from . import enums
+from . import filters
+from . import record
+from . import routing
+from . import snapshot
+from . import stages
+from . import state
+from .enums import Flags
+from .events import Event
+from .stats import Stats
 
-Event = collections.namedtuple('Event', ['flags', 'cookie', 'name', 'alias'])
+logger = logging.getLogger('aionotify')
 
+WatchRequest = collections.namedtuple(
+    'WatchRequest', ['path', 'flags', 'recursive', 'include', 'exclude'], defaults=[False, None, None],
+)
 
-_libc = ctypes.cdll.LoadLibrary('libc.so.6')
+
+# Loaded on first use, like other optional modules; see the package docstring.
+_libc = None
+
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        import ctypes
+
+        libc = ctypes.CDLL('libc.so.6', use_errno=True)
+        # Bind prototypes once, sparing ctypes from guessing argument conversions on each call.
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_init1.restype = ctypes.c_int
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_add_watch.restype = ctypes.c_int
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        libc.inotify_rm_watch.restype = ctypes.c_int
+        _libc = libc
+    return _libc
+
+
+def _oserror(filename=None):
+    """Build an OSError from the errno of the last failed libc call."""
+    import ctypes
+
+    err = ctypes.get_errno()
+    return OSError(err, os.strerror(err), filename)
+
+
+# inotify_init1() flags; they share their values with O_NONBLOCK / O_CLOEXEC.
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
 
 
 class LibC:
-    """Proxy to C functions for inotify"""
+    """Proxy to C functions for inotify; failures raise OSError."""
     @classmethod
-    def inotify_init(cls):
-        return _libc.inotify_init()
+    def inotify_init(cls, flags=IN_NONBLOCK | IN_CLOEXEC):
+        """Create an inotify instance; by default, non-blocking and not inherited by child processes."""
+        fd = _load_libc().inotify_init1(flags)
+        if fd < 0:
+            raise _oserror()
+        return fd
 
     @classmethod
     def inotify_add_watch(cls, fd, path, flags):
-        return _libc.inotify_add_watch(fd, path.encode('utf-8'), flags)
+        """Add a watch, returning its descriptor; ``path`` may be bytes, to skip encoding it."""
+        if isinstance(path, str):
+            path = os.fsencode(path)
+        wd = _load_libc().inotify_add_watch(fd, path, flags)
+        if wd < 0:
+            raise _oserror(os.fsdecode(path))
+        return wd
 
     @classmethod
     def inotify_rm_watch(cls, fd, wd):
-        return _libc.inotify_rm_watch(fd, wd)
+        if _load_libc().inotify_rm_watch(fd, wd) != 0:
+            raise _oserror()
+
+    @classmethod
+    def inotify_queued(cls, fd):
+        """Number of bytes waiting in the kernel queue of an inotify instance."""
+        import fcntl
+        import termios
+
+        return struct.unpack('i', fcntl.ioctl(fd, termios.FIONREAD, bytes(4)))[0]
+
+    @classmethod
+    def add_watches(cls, fd, watches):
+        """Add a batch of (bytes path, flags) watches.
+
+        Returns, for each watch, either its descriptor or an OSError.
+        """
+        add_watch = _load_libc().inotify_add_watch
+        results = []
+        for path, flags in watches:
+            wd = add_watch(fd, path, flags)
+            results.append(wd if wd >= 0 else _oserror(os.fsdecode(path)))
+        return results
+
+    @classmethod
+    def rm_watches(cls, fd, wds):
+        """Remove a batch of watches; returns None or an OSError for each."""
+        rm_watch = _load_libc().inotify_rm_watch
+        return [_oserror() if rm_watch(fd, wd) != 0 else None for wd in wds]
 
 
 PREFIX = struct.Struct('iIII')
 
+#: Size of the largest possible inotify record: header, NAME_MAX bytes and a final NUL.
+EVENT_MAX_SIZE = PREFIX.size + 255 + 1
+
+# Flags required on each directory of a recursive watch, to maintain the tree.
+TREE_FLAGS = Flags.CREATE | Flags.MOVED_FROM | Flags.MOVED_TO
+
 
-class Watcher:
+class BaseWatcher:
+    """Watch management and event decoding, shared by Watcher and SyncWatcher.
 
-    def __init__(self):
+    See Watcher for the available options.
+    """
+
+    default_read_size = 65536
+    #: Number of files remembered by ``verify_content``.
+    verify_cache_size = 10000
+    #: With ``max_watches``, how often polled directories are scanned (in seconds).
+    poll_interval = 1.0
+    #: With ``rescan_on_overflow``, how often directories with events get a new snapshot (in seconds).
+    refresh_interval = 5.0
+
+    def __init__(
+            self, *, read_size=None, coalesce_window=None, rename_window=None, rescan_on_overflow=False,
+            max_queue=None, queue_policy=aioutils.QUEUE_BLOCK, stats=False, state_file=None, verify_content=False,
+            record_file=None, max_watches=None, timestamps=False, trace=None):
+        if read_size is None:
+            read_size = self.default_read_size
+        if read_size < EVENT_MAX_SIZE:
+            raise ValueError("read_size must be at least %d bytes, got %d" % (EVENT_MAX_SIZE, read_size))
+        if queue_policy not in aioutils.QUEUE_POLICIES:
+            raise ValueError("Unknown queue policy %r; valid choices are %r" % (queue_policy, aioutils.QUEUE_POLICIES))
+        self.read_size = read_size
+        self.max_queue = max_queue
+        self.queue_policy = queue_policy
+        self.coalesce_window = coalesce_window
+        self.rename_window = rename_window
+        self.rescan_on_overflow = rescan_on_overflow
+        self.state_file = state_file
+        # (requests, fingerprints) handed over by a ShardedWatcher, instead of a state file.
+        self._saved_state = None
+        self.verify_content = verify_content
+        self.record_file = record_file
+        self.max_watches = max_watches
+        self.timestamps = timestamps
+        self.trace = trace
+        self._recorder = None
         self.requests = {}
+        # alias => NameFilter, for watches with include / exclude patterns.
+        self._filters = {}
+        # alias => number of events dropped by the name filters.
+        self.filtered = collections.Counter()
+        if stats is True:
+            stats = Stats()
+        self.stats = stats or None
         self._reset()
 
+    def _make_stages(self):
+        """Build the processing stages run before delivering events."""
+        pipeline = []
+        if self.rename_window is not None:
+            pipeline.append(stages.RenamePairer(self.rename_window))
+        if self.coalesce_window is not None:
+            pipeline.append(stages.Coalescer(self.coalesce_window))
+        if self.verify_content:
+            pipeline.append(stages.ContentVerifier(self._event_path, cache_size=self.verify_cache_size))
+        return pipeline
+
+    def _event_path(self, event):
+        """Filesystem path of an event's file, if its watch is still there."""
+        request = self.requests.get(event.alias)
+        if request is None:
+            return None
+        return os.path.join(request.path, event.name) if event.name else request.path
+
     def _reset(self):
+        self._stages = self._make_stages()
+        self._ready = collections.deque()
         self.descriptors = {}
         self.aliases = {}
-        self._stream = None
-        self._transport = None
+        # For recursive watches: wd => path relative to the watch root ('' for the root),
+        # and alias => {relative path: wd}.
+        self._subdirs = {}
+        self._trees = {}
+        # cookie => (alias, relative path) of directories moved out of a tree, waiting for their MOVED_TO.
+        self._moves = {}
+        # For rescan_on_overflow: wd => snapshot, and pending snapshot work;
+        # wds with events since their snapshot, and overflows seen so far.
+        self._snapshots = {}
+        self._unsnapshotted = set()
+        self._rescan_requested = False
+        self._stale = set()
+        self._overflows = self._scan_overflows = 0
+        # Fingerprints from the state file, until the rescan against them:
+        # (alias, relative path) => snapshot.
+        self._fingerprints = None
+        # For max_watches: subdirectory wds, least recently active first,
+        # and (alias, relative path) => snapshot of directories polled instead;
+        # evicted wds still decoded until their IGNORED record => snapshot to poll from.
+        self._active = collections.OrderedDict()
+        self._polled = {}
+        self._evicting = {}
+        # While watches are being registered from a worker thread, raw records
+        # for descriptors not known yet, and the number of such registrations.
+        self._orphans = []
+        self._registering = 0
+        self._protocol = None
         self._fd = None
-        self._loop = None
 
-    def watch(self, path, flags, *, alias=None):
-        """Add a new watching rule."""
+    def watch(self, path, flags, *, alias=None, recursive=False, include=None, exclude=None):
+        """Add a new watching rule.
+
+        With ``recursive=True``, the whole directory tree below ``path`` is
+        watched, including subdirectories created later on; event names are
+        then relative to ``path``.
+
+        ``include`` and ``exclude`` select events by name, before they get
+        queued; they accept a glob pattern, a list of those, or a compiled
+        regular expression. Dropped events are counted in ``filtered``.
+        """
+        alias = self._add_request(path, flags, alias, recursive, include, exclude)
+        if self._fd is not None:
+            # We've started, register the watch immediately.
+            self._setup_watch(alias, path, flags, recursive=recursive)
+
+    def _add_request(self, path, flags, alias=None, recursive=False, include=None, exclude=None):
+        """Record a watch request, and return its alias."""
         if alias is None:
             alias = path
         if alias in self.requests:
             raise ValueError("A watch request is already scheduled for alias %s" % alias)
-        self.requests[alias] = (path, flags)
-        if self._fd is not None:
-            # We've started, register the watch immediately.
-            self._setup_watch(alias, path, flags)
+        if include is not None or exclude is not None:
+            self._filters[alias] = filters.NameFilter(include, exclude)
+        self.requests[alias] = WatchRequest(path, flags, recursive, include, exclude)
+        return alias
+
+    def _drop_request(self, alias):
+        """Undo _add_request()."""
+        del self.requests[alias]
+        self._filters.pop(alias, None)
 
     def unwatch(self, alias):
         """Stop watching a given rule."""
         if alias not in self.descriptors:
             raise ValueError("Unknown watch alias %s; current set is %r" % (alias, list(self.descriptors.keys())))
-        wd = self.descriptors[alias]
-        errno = LibC.inotify_rm_watch(self._fd, wd)
-        if errno != 0:
-            raise IOError("Failed to close watcher %d: errno=%d" % (wd, errno))
-        del self.descriptors[alias]
-        del self.requests[alias]
+        LibC.inotify_rm_watch(self._fd, self.descriptors[alias])
+        self._forget_watch(alias)
+
+    def set_flags(self, alias, flags, *, add=False):
+        """Change the flags of a watching rule.
+
+        With ``add=True``, ``flags`` are added to the current ones, through
+        ``Flags.MASK_ADD``; otherwise, they replace them.
+        """
+        if alias not in self.requests:
+            raise ValueError("Unknown watch alias %s; current set is %r" % (alias, list(self.requests.keys())))
+        request = self.requests[alias]
+        self.requests[alias] = request._replace(flags=request.flags | flags if add else flags)
+        if alias not in self.descriptors:
+            # Not registered yet.
+            return
+
+        mask = flags | Flags.MASK_ADD if add else flags
+        if request.recursive:
+            mask |= TREE_FLAGS
+            for relpath in self._trees[alias]:
+                if relpath:
+                    try:
+                        LibC.inotify_add_watch(
+                            self._fd, os.path.join(request.path, relpath), mask | Flags.ONLYDIR | Flags.DONT_FOLLOW,
+                        )
+                    except OSError:
+                        # Removed meanwhile; its events will tell.
+                        pass
+        LibC.inotify_add_watch(self._fd, request.path, mask)
+
+    def _forget_watch(self, alias):
+        """Drop all state related to a watch, once removed from the kernel."""
+        wd = self.descriptors.pop(alias)
+        for relpath, subwd in self._trees.pop(alias, {}).items():
+            del self._subdirs[subwd]
+            if relpath:
+                self._remove_subdir(subwd)
+        self._drop_request(alias)
         del self.aliases[wd]
+        self._snapshots.pop(wd, None)
+        for key in [key for key in self._polled if key[0] == alias]:
+            del self._polled[key]
+
+        # Drop events already read for that watch.
+        def predicate(event):
+            return event.alias == alias
 
-    def _setup_watch(self, alias, path, flags):
+        self._protocol.discard(predicate)
+        for stage in self._stages:
+            stage.discard(predicate)
+        self._ready = collections.deque(event for event in self._ready if not predicate(event))
+
+    def _setup_watch(self, alias, path, flags, recursive=False):
         """Actual rule setup."""
         assert alias not in self.descriptors, "Registering alias %s twice!" % alias
+        if recursive:
+            flags |= TREE_FLAGS
+        self._make_room()
         wd = LibC.inotify_add_watch(self._fd, path, flags)
-        if wd < 0:
-            raise IOError("Error setting up watch on %s with flags %s: wd=%s" % (
-                path, flags, wd))
         self.descriptors[alias] = wd
         self.aliases[wd] = alias
+        if recursive:
+            self._subdirs[wd] = ''
+            self._trees[alias] = {'': wd}
+        self._track(wd)
+        if recursive:
+            self._add_subtree(alias, '')
+
+    def _add_subdir(self, alias, relpath, evict=False):
+        """Watch a subdirectory of a recursive watch; return whether it is tracked, False if it vanished.
+
+        With ``max_watches``, the directory gets polled instead once the budget
+        is reached; with ``evict=True``, the least recently active watches get
+        polled instead, to make room for it.
+        """
+        request = self.requests[alias]
+        path = os.path.join(request.path, relpath)
+        if self.max_watches is not None and self._watch_count() >= self.max_watches:
+            if not (evict and self._make_room()):
+                return self._poll(alias, relpath)
+        try:
+            wd = LibC.inotify_add_watch(self._fd, path, request.flags | TREE_FLAGS | Flags.ONLYDIR | Flags.DONT_FOLLOW)
+        except OSError as e:
+            if self.max_watches is not None and e.errno == errno.ENOSPC:
+                # Out of kernel watches for the user.
+                return self._poll(alias, relpath)
+            logger.warning("Unable to watch %s, skipping it: %s", path, e)
+            return False
+        self.aliases[wd] = alias
+        self._subdirs[wd] = relpath
+        self._trees[alias][relpath] = wd
+        if self.max_watches is not None:
+            self._active[wd] = None
+        self._track(wd)
+        return True
+
+    def _remove_subdir(self, wd):
+        """Stop watching a subdirectory; it might already be gone."""
+        try:
+            LibC.inotify_rm_watch(self._fd, wd)
+        except OSError:
+            pass
+        del self.aliases[wd]
+        self._active.pop(wd, None)
+        self._snapshots.pop(wd, None)
+        self._evicting.pop(wd, None)
+
+    def _add_subtree(self, alias, relpath):
+        """Watch all directories below a watched one.
+
+        Each directory is watched before being listed, so that no
+        subdirectory can be created unnoticed. Returns the entries found,
+        as (relative path, is_dir) pairs.
+        """
+        found = []
+        pending = [relpath]
+        while pending:
+            parent = pending.pop()
+            try:
+                entries = self._list_subdir(alias, parent)
+            except OSError:
+                # Removed (or replaced) in the meantime, we'll get an event for that.
+                continue
+            for name, is_dir in entries:
+                child = parent + '/' + name if parent else name
+                found.append((child, is_dir))
+                if is_dir and self._add_subdir(alias, child):
+                    pending.append(child)
+        return found
+
+    def _list_subdir(self, alias, relpath):
+        """List a directory of a tree, as (name, is_dir) pairs.
+
+        While catching up, a directory whose inode and modification time
+        match its saved fingerprint still has the saved names: it is not read.
+        """
+        path = os.path.join(self.requests[alias].path, relpath)
+        saved = self._fingerprints.get((alias, relpath)) if self._fingerprints and relpath else None
+        if saved is not None:
+            parent, name = os.path.split(relpath)
+            entry = self._fingerprints.get((alias, parent), {}).get(name)
+            st = os.lstat(path)
+            if entry is not None and entry[:2] == (st.st_ino, st.st_mtime_ns):
+                return [(child, is_dir) for child, (_inode, _mtime, _size, is_dir) in saved.items()]
+        with os.scandir(path) as entries:
+            return [(entry.name, entry.is_dir(follow_symlinks=False)) for entry in entries]
+
+    def _remove_subtree(self, alias, relpath):
+        """Stop watching a directory and all its subdirectories."""
+        tree = self._trees[alias]
+        prefix = relpath + '/'
+        for child in [child for child in tree if child == relpath or child.startswith(prefix)]:
+            wd = tree.pop(child)
+            del self._subdirs[wd]
+            self._remove_subdir(wd)
+        for key in list(self._polled):
+            if key[0] == alias and (key[1] == relpath or key[1].startswith(prefix)):
+                del self._polled[key]
+
+    def _rename_subtree(self, alias, relpath, new_relpath):
+        """Move the watches of a renamed directory and its subdirectories to their new paths.
+
+        Returns whether the directory was tracked.
+        """
+        # The target, if it existed, was replaced.
+        self._remove_subtree(alias, new_relpath)
+        tree = self._trees[alias]
+        prefix = relpath + '/'
+        tracked = False
+        for child in [child for child in tree if child == relpath or child.startswith(prefix)]:
+            wd = tree.pop(child)
+            tree[new_relpath + child[len(relpath):]] = wd
+            self._subdirs[wd] = new_relpath + child[len(relpath):]
+            tracked = True
+        for key in [key for key in self._polled if key[0] == alias]:
+            if key[1] == relpath or key[1].startswith(prefix):
+                self._polled[(alias, new_relpath + key[1][len(relpath):])] = self._polled.pop(key)
+                tracked = True
+        return tracked
+
+    def _expire_moves(self, keep=None):
+        """Stop watching directories moved out of their tree, except the one moved with cookie ``keep``."""
+        for cookie in [cookie for cookie in self._moves if cookie != keep]:
+            alias, relpath = self._moves.pop(cookie)
+            if alias in self._trees:
+                self._remove_subtree(alias, relpath)
+
+    def _tree_event(self, wd, relpath, flags, cookie, raw_name):
+        """Handle an event from a recursive watch.
+
+        Maintains the directory tree, and returns the list of events to
+        deliver: none if the event was not requested, maybe some synthetic
+        ones for the content of new directories.
+        """
+        alias = self.aliases[wd]
+        if flags & enums.IGNORED and relpath:
+            # A subdirectory watch went away.
+            del self._subdirs[wd]
+            del self.aliases[wd]
+            if self._trees[alias].get(relpath) == wd:
+                del self._trees[alias][relpath]
+            self._active.pop(wd, None)
+            self._snapshots.pop(wd, None)
+            entries = self._evicting.pop(wd, None)
+            if entries is not None and relpath not in self._trees[alias]:
+                # Evicted, and all its events read: poll it from now on.
+                self._polled[(alias, relpath)] = entries
+            return []
+        if wd in self._active:
+            self._active.move_to_end(wd)
+        return self._tree_changes(alias, relpath, flags, cookie, raw_name)
+
+    def _tree_changes(self, alias, relpath, flags, cookie, raw_name):
+        """Handle a change in a directory of a recursive watch, reported by the kernel or by polling."""
+        requested = self.requests[alias].flags
+        raw_name = raw_name.rstrip(b'\x00')
+        # Filters apply to the file name, not its path within the tree.
+        basename = raw_name
+        if relpath:
+            prefix = os.fsencode(relpath)
+            raw_name = prefix + b'/' + raw_name if raw_name else prefix
+
+        events = []
+        if flags & requested or (flags & enums.KERNEL_FLAGS and not relpath):
+            if self._accept(alias, basename):
+                events.append(Event(flags, cookie, raw_name, alias))
+
+        if flags & enums.ISDIR:
+            name = os.fsdecode(raw_name)
+            if flags & enums.CREATE:
+                if self._add_subdir(alias, name, evict=True):
+                    # Report entries created before the watch was set up.
+                    for child, is_dir in self._add_subtree(alias, name):
+                        basename = os.fsencode(os.path.basename(child))
+                        if requested & Flags.CREATE and self._accept(alias, basename):
+                            events.append(Event(Flags.CREATE | (Flags.ISDIR if is_dir else 0), 0, child, alias))
+            elif flags & enums.MOVED_TO:
+                # Within a tree, watches follow the directory: events already queued for it are kept.
+                source = self._moves.pop(cookie, None)
+                if source is not None:
+                    if source[0] == alias and self._rename_subtree(alias, source[1], name):
+                        return events
+                    if source[0] in self._trees:
+                        # Moved from another tree.
+                        self._remove_subtree(*source)
+                if self._add_subdir(alias, name, evict=True):
+                    self._add_subtree(alias, name)
+            elif flags & enums.MOVED_FROM:
+                # Kept until the next record, which should be the matching MOVED_TO; see _decode().
+                self._moves[cookie] = (alias, name)
+        return events
+
+    def _accept(self, alias, raw_name):
+        """Check a stripped raw name against the filter of a watch; count dropped ones."""
+        if raw_name and alias in self._filters and not self._filters[alias](raw_name):
+            self.filtered[alias] += 1
+            return False
+        return True
+
+    # Watch budget
+    # ============
+
+    def _watch_count(self):
+        """Number of kernel watches in use."""
+        return len(self.aliases) - len(self._evicting)
+
+    def _make_room(self, count=1):
+        """Evict subdirectory watches until ``count`` more fit within ``max_watches``; return whether they do."""
+        if self.max_watches is None:
+            return True
+        while self._watch_count() + count > self.max_watches:
+            if not self._active:
+                return False
+            self._evict(next(iter(self._active)))
+        return True
+
+    def _evict(self, wd):
+        """Replace a subdirectory watch with polling.
+
+        The directory is snapshotted before its watch is removed: events
+        the kernel queued until then are still decoded, and polling starts
+        from that snapshot once its IGNORED record arrives.
+        """
+        path = self._watch_path(wd)
+        try:
+            entries = snapshot.scan(path)
+        except OSError:
+            # Removed; reported through its parent.
+            entries = None
+        try:
+            LibC.inotify_rm_watch(self._fd, wd)
+        except OSError:
+            pass
+        self._active.pop(wd, None)
+        self._snapshots.pop(wd, None)
+        self._evicting[wd] = entries
+
+    def _poll(self, alias, relpath):
+        """Start polling a subdirectory; return whether it still exists."""
+        try:
+            self._polled[(alias, relpath)] = snapshot.scan(os.path.join(self.requests[alias].path, relpath))
+        except OSError:
+            return False
+        return True
+
+    def _poll_paths(self):
+        """Paths of the polled directories, keyed by (alias, relative path)."""
+        return {key: os.path.join(self.requests[key[0]].path, key[1]) for key in self._polled}
+
+    def _store_polls(self, paths, snapshots):
+        """Queue events for changes in polled directories, and watch those again."""
+        events = []
+        for key in paths:
+            previous = self._polled.get(key)
+            if previous is None:
+                # Dropped meanwhile.
+                continue
+            entries = snapshots.get(key)
+            if entries is None:
+                # Removed; reported through its parent.
+                del self._polled[key]
+                continue
+            changes = snapshot.diff(previous, entries)
+            if not changes:
+                continue
+
+            # Activity: switch back to a kernel watch, evicting a less active one if needed.
+            alias, relpath = key
+            del self._polled[key]
+            if not self._add_subdir(alias, relpath, evict=True):
+                continue
+            for name, flags in changes:
+                if alias not in self.requests:
+                    break
+                events.extend(self._tree_changes(alias, relpath, flags, 0, os.fsencode(name)))
+        self._protocol.feed_events(events)
+
+    # Overflow handling
+    # =================
+
+    def _track(self, wd):
+        """Record a new kernel watch; schedule its snapshot, if rescans are enabled."""
+        if self._recorder is not None:
+            alias = self.aliases[wd]
+            self._recorder.record_watch(wd, alias, self.requests[alias], self._subdirs.get(wd))
+        if self.rescan_on_overflow:
+            self._unsnapshotted.add(wd)
+            self._schedule_snapshots()
+
+    def _schedule_snapshots(self):
+        """Arrange for pending snapshots and rescans to be performed."""
+        raise NotImplementedError()
+
+    def _pending_snapshots(self):
+        """Pop pending snapshot work: return whether it is a rescan, and the {wd: path} to scan."""
+        rescan = self._rescan_requested
+        if rescan:
+            wds = list(self.aliases)
+        else:
+            wds = [wd for wd in self._unsnapshotted if wd in self.aliases]
+        self._rescan_requested = False
+        self._unsnapshotted = set()
+        self._scan_overflows = self._overflows
+        return rescan, {wd: self._watch_path(wd) for wd in wds}
+
+    def _store_snapshots(self, rescan, snapshots):
+        """Record new snapshots; after a rescan, queue events for the differences.
+
+        A refreshed snapshot may include changes whose events were still in
+        the kernel queue, and could get lost to an overflow: it is only kept
+        once all events are read, with no overflow among them.
+        """
+        if rescan:
+            self._protocol.feed_events(self._rescan_events(snapshots))
+            self._snapshots = {}
+            self._fingerprints = None
+        elif self._overflows != self._scan_overflows or LibC.inotify_queued(self._fd):
+            for wd in [wd for wd in snapshots if wd in self._snapshots]:
+                del snapshots[wd]
+                self._stale.add(wd)
+        self._snapshots.update(snapshots)
+
+    def _refresh_snapshots(self):
+        """Schedule new snapshots of the directories with events since their last one."""
+        if self._stale:
+            self._unsnapshotted |= self._stale
+            self._stale = set()
+            self._schedule_snapshots()
+
+    # Persistent state
+    # ================
+
+    def _load_state(self):
+        """Add the watches saved in the state file, and keep its fingerprints.
+
+        Saved paths which no longer exist are skipped. Returns the events
+        reporting the missing paths, or None without a saved state.
+        """
+        if self._saved_state is not None:
+            (requests, fingerprints), self._saved_state = self._saved_state, None
+        elif self.state_file is None:
+            return None
+        else:
+            try:
+                requests, fingerprints = state.load(self.state_file)
+            except FileNotFoundError:
+                return None
+        events = []
+        for alias, request in requests.items():
+            if alias in self.requests:
+                continue
+            path, flags, recursive, include, exclude = request
+            if os.path.lexists(path):
+                self._add_request(path, flags, alias, recursive, include, exclude)
+            else:
+                events.extend(self._removal_events(alias, flags, filters.NameFilter(include, exclude), fingerprints))
+        self._fingerprints = fingerprints
+        return events
+
+    @staticmethod
+    def _removal_events(alias, flags, name_filter, fingerprints, subdir=''):
+        """Events for a saved watch whose path was removed while stopped: its entries, then itself.
+
+        With ``subdir``, only report the entries of that removed subdirectory of a tree.
+        """
+        events = []
+        if flags & Flags.DELETE:
+            prefix = subdir + '/'
+            # Deepest directories first, as the kernel reports them.
+            trees = sorted((
+                (relpath, entries) for (key, relpath), entries in fingerprints.items()
+                if key == alias and (not subdir or relpath == subdir or relpath.startswith(prefix))
+            ), reverse=True)
+            for relpath, entries in trees:
+                for name, entry in entries.items():
+                    raw_name = os.fsencode(name)
+                    if name_filter(raw_name):
+                        events.append(Event(
+                            Flags.DELETE | (Flags.ISDIR if entry[3] else 0), 0,
+                            os.fsencode(os.path.join(relpath, name)) if relpath else raw_name, alias,
+                        ))
+        if flags & Flags.DELETE_SELF and not subdir:
+            events.append(Event(Flags.DELETE_SELF, 0, b'', alias))
+        return events
+
+    def _restore_fingerprints(self, events):
+        """Queue events for removed paths; use saved fingerprints as snapshots, and request a rescan against them."""
+        if events:
+            self._protocol.feed_events(events)
+        for wd, alias in self.aliases.items():
+            key = (alias, self._subdirs.get(wd, ''))
+            if key in self._fingerprints:
+                self._snapshots[wd] = self._fingerprints[key]
+        self._rescan_requested = True
+
+    def _fingerprint_paths(self):
+        """Paths of all watched directories, keyed by (alias, relative path)."""
+        return {(alias, self._subdirs.get(wd, '')): self._watch_path(wd) for wd, alias in self.aliases.items()}
+
+    @staticmethod
+    def _write_state(path, requests, paths):
+        state.dump(path, requests, snapshot.scan_all(paths))
+
+    def _watch_path(self, wd):
+        """Filesystem path of a watch."""
+        path = self.requests[self.aliases[wd]].path
+        relpath = self._subdirs.get(wd)
+        return os.path.join(path, relpath) if relpath else path
+
+    def _rescan_events(self, snapshots):
+        """Build synthetic events from the differences with previous snapshots."""
+        events = []
+        for wd, entries in snapshots.items():
+            previous = self._snapshots.get(wd)
+            if previous is None:
+                continue
+            for name, flags in snapshot.diff(previous, entries):
+                if wd not in self.aliases:
+                    # Dropped while processing a previous change.
+                    break
+                raw_name = os.fsencode(name)
+                if wd in self._subdirs:
+                    if self._fingerprints and flags & Flags.DELETE and flags & Flags.ISDIR:
+                        # Removed while stopped: report its content too, as for a removed watch.
+                        alias = self.aliases[wd]
+                        events.extend(self._removal_events(
+                            alias, self.requests[alias].flags, functools.partial(self._accept, alias),
+                            self._fingerprints, subdir=os.path.join(self._subdirs[wd], name),
+                        ))
+                    events.extend(self._tree_event(wd, self._subdirs[wd], flags, 0, raw_name))
+                else:
+                    alias = self.aliases[wd]
+                    if flags & self.requests[alias].flags and self._accept(alias, raw_name):
+                        events.append(Event(flags, 0, raw_name, alias))
+        return events
+
+    def _overflow(self):
+        """Handle a kernel queue overflow; return the event to deliver."""
+        if self.rescan_on_overflow:
+            self._overflows += 1
+            self._rescan_requested = True
+            self._schedule_snapshots()
+        if self.stats is not None:
+            self.stats.record_overflow()
+        return Event(Flags.Q_OVERFLOW, 0, b'', None)
+
+    def _decode(self, data):
+        """Decode a buffer of raw inotify records into events.
+
+        The kernel only returns whole records, so ``data`` never holds
+        a partial one. Events for removed watches are skipped.
+        """
+        events = []
+        aliases = self.aliases
+        subdirs = self._subdirs
+        name_filters = self._filters
+        stale = self._stale if self.rescan_on_overflow else None
+        moves = self._moves
+        unpack_from = PREFIX.unpack_from
+        view = memoryview(data)
+        offset = 0
+        end = len(view)
+        while offset < end:
+            wd, flags, cookie, length = unpack_from(view, offset)
+            offset += PREFIX.size
+            if moves:
+                # The kernel queues both halves of a rename together: a directory
+                # whose MOVED_FROM is not followed by its MOVED_TO left its tree,
+                # even if that record only comes with the next read.
+                self._expire_moves(keep=cookie if flags & enums.MOVED_TO else None)
+            if wd in aliases:
+                if stale is not None:
+                    stale.add(wd)
+                # Names are decoded lazily by the Event.
+                name = bytes(view[offset:offset + length])
+                alias = aliases[wd]
+                if wd in subdirs:
+                    events.extend(self._tree_event(wd, subdirs[wd], flags, cookie, name))
+                elif name_filters and alias in name_filters:
+                    name = name.rstrip(b'\x00')
+                    if self._accept(alias, name):
+                        events.append(Event(flags, cookie, name, alias))
+                else:
+                    events.append(Event(flags, cookie, name, alias))
+            elif flags & enums.Q_OVERFLOW:
+                events.append(self._overflow())
+            elif self._registering:
+                # Maybe a watch being registered; decoded again once done.
+                self._orphans.append(bytes(view[offset - PREFIX.size:offset + length]))
+            elif self.stats is not None:
+                self.stats.record_unknown_watch()
+            offset += length
+        return events
+
+    def _make_protocol(self, loop):
+        """Build the protocol decoding reads, and queueing the resulting events."""
+        return aioutils.InotifyProtocol(
+            self._decode,
+            loop=loop,
+            buffer_size=self.read_size,
+            high_water=self.max_queue,
+            policy=self.queue_policy,
+            stats=self.stats,
+            timestamps=self.timestamps,
+            trace=self.trace,
+        )
+
+    def _open_recorder(self):
+        if self.record_file is not None:
+            self._recorder = record.Recorder(self.record_file)
+
+    def _close_recorder(self):
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
+
+    def _deliver(self, events):
+        """Hand events over to the consumer."""
+        if self.trace is not None and events:
+            self.trace('deliver', time.monotonic(), events)
+        return events
+
+    def _run_stages(self, now):
+        """Move queued events through the processing stages."""
+        events = self._protocol.take()
+        for stage in self._stages:
+            events = stage.feed(events, now)
+        self._ready.extend(events)
+
+
+class Watcher(BaseWatcher):
+    """Watch a set of paths.
+
+    ``read_size`` is the size of the buffer used for each read from the kernel;
+    it must fit at least one record with the longest possible name.
+
+    With ``coalesce_window`` (in seconds), events for the same alias and name
+    occurring within that window are merged into a single event, carrying
+    all their flags; that event is delivered once the window closes.
+
+    With ``rename_window`` (in seconds), MOVED_FROM and MOVED_TO events sharing
+    a cookie are delivered as a single Rename event; a MOVED_FROM waits at most
+    that long for its MOVED_TO, and is delivered alone if none arrives.
+
+    When the kernel queue overflows, events are lost; this is reported through
+    an event with the Q_OVERFLOW flag and no alias. With ``rescan_on_overflow``,
+    the watcher keeps a snapshot of each watched directory, and after an
+    overflow emits CREATE / DELETE / MODIFY events for the differences between
+    that snapshot and the current content. Directories with events get a new
+    snapshot every ``refresh_interval`` seconds, once all pending events are
+    read; changes reported since then may get reported again.
+
+    With ``max_queue``, at most that many events are kept in memory; once
+    reached, ``queue_policy`` applies: ``'block'`` stops reading from the
+    kernel until half of the queue has been consumed, ``'drop-oldest'``
+    drops the oldest events, and ``'coalesce'`` merges events for the same
+    name, then blocks if that wasn't enough.
+
+    With ``stats=True`` (or a shared aionotify.stats.Stats), counters and
+    latency histograms are kept in ``watcher.stats``; see ``stats.snapshot()``.
+
+    With ``verify_content``, CLOSE_WRITE events for files whose content did
+    not change are dropped: files are compared by inode, size and mtime, then
+    by a hash of their content, computed from a thread pool, if only their
+    mtime changed.
+
+    With ``max_watches``, at most that many kernel watches are used. Once
+    reached, the least recently active subdirectories of recursive watches
+    are polled instead, every ``poll_interval`` seconds; a polled directory
+    showing changes gets watched again. Watches added with ``watch()`` always
+    get a kernel watch. Subdirectories are also polled when the kernel runs
+    out of watches for the user (``fs.inotify.max_user_watches``).
+
+    With ``timestamps=True``, each event's ``timestamp`` holds the monotonic
+    time (see ``time.monotonic()``) of the read from the kernel which returned
+    it; events found by rescans and polling have none. ``trace``, a callable,
+    is called as ``trace(stage, time, value)`` along the way of events:
+    ``'read'`` with the number of bytes read, then ``'decode'`` and
+    ``'deliver'`` with the list of events decoded from that read, and handed
+    to the consumer.
+
+    With ``record_file``, the raw bytes of each read from the kernel are logged
+    to that file, along with the watches; see ReplayWatcher to replay them.
+
+    With ``state_file``, ``save_state()`` records the watches and a fingerprint
+    of each watched directory. On the next ``setup()``, those watches are
+    added back, and CREATE / DELETE / MODIFY events are emitted for the
+    changes since the fingerprints were taken. Saved paths which no longer
+    exist are dropped, and reported as DELETE / DELETE_SELF events. This
+    spares the restart from delivering the whole tree as new, but catching
+    up still rescans every watched directory: it takes time proportional to
+    the tree size, not to the changes.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._router = routing.Router()
+
+    def _reset(self):
+        super()._reset()
+        self._snapshot_task = None
+        self._poll_task = None
+        self._refresh_task = None
+        self._transport = None
+        self._loop = None
+
+    def _forget_watch(self, alias):
+        super()._forget_watch(alias)
+        self._router.forget(alias)
+
+    async def watch_many(self, watches):
+        """Add a batch of (path, flags, alias) watching rules.
+
+        Once started, watches are registered from a worker thread, sparing
+        the event loop. Failures do not abort the batch: they are returned,
+        as an {alias: exception} dict.
+        """
+        errors = {}
+        added = []
+        for path, flags, alias in watches:
+            try:
+                alias = self._add_request(path, flags, alias)
+            except ValueError as e:
+                errors[path if alias is None else alias] = e
+            else:
+                added.append(alias)
+
+        if self._fd is not None:
+            failed = await self._register_watches(added)
+            for alias in failed:
+                self._drop_request(alias)
+            errors.update(failed)
+        return errors
+
+    async def _register_watches(self, aliases):
+        """Register non-recursive requests with the kernel, from a worker thread.
+
+        Returns an {alias: OSError} dict of failures.
+        """
+        watches = [(os.fsencode(self.requests[alias].path), self.requests[alias].flags) for alias in aliases]
+        self._make_room(len(watches))
+        self._registering += 1
+        try:
+            results = await self._loop.run_in_executor(None, LibC.add_watches, self._fd, watches)
+        finally:
+            self._registering -= 1
+
+        errors = {}
+        for alias, result in zip(aliases, results):
+            if isinstance(result, OSError):
+                errors[alias] = result
+            else:
+                self.descriptors[alias] = result
+                self.aliases[result] = alias
+                self._track(result)
+
+        if self._orphans and not self._registering:
+            # Events read before their watch was recorded.
+            orphans, self._orphans = self._orphans, []
+            self._protocol.feed_events(self._decode(b''.join(orphans)))
+        return errors
+
+    async def unwatch_many(self, aliases):
+        """Remove a batch of watching rules, from a worker thread.
+
+        Failures do not abort the batch: they are returned, as an
+        {alias: exception} dict.
+        """
+        errors = {}
+        removed = []
+        for alias in aliases:
+            if alias in self.descriptors:
+                removed.append(alias)
+            else:
+                errors[alias] = ValueError("Unknown watch alias %s" % alias)
+        if not removed:
+            return errors
+
+        wds = [self.descriptors[alias] for alias in removed]
+        results = await self._loop.run_in_executor(None, LibC.rm_watches, self._fd, wds)
+        for alias, error in zip(removed, results):
+            if error is not None:
+                errors[alias] = error
+            else:
+                self._forget_watch(alias)
+        return errors
+
+    def _schedule_snapshots(self):
+        if self._snapshot_task is None and self._loop is not None:
+            self._snapshot_task = self._loop.create_task(self._take_snapshots())
+
+    async def _take_snapshots(self):
+        """Take pending snapshots, and perform requested rescans, in a worker thread."""
+        try:
+            while self._rescan_requested or self._unsnapshotted:
+                rescan, paths = self._pending_snapshots()
+                snapshots = await self._loop.run_in_executor(None, snapshot.scan_all, paths)
+                self._store_snapshots(rescan, snapshots)
+        finally:
+            self._snapshot_task = None
+
+    async def _poll_directories(self):
+        """Periodically scan polled directories, from a worker thread."""
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            paths = self._poll_paths()
+            if paths:
+                snapshots = await self._loop.run_in_executor(None, snapshot.scan_all, paths)
+                self._store_polls(paths, snapshots)
+
+    async def _refresh_periodically(self):
+        """Periodically refresh the snapshots of directories with events."""
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            self._refresh_snapshots()
 
     async def setup(self, loop=None):
         """Start the watcher, registering new watches if any."""
         self._loop = loop or asyncio.get_running_loop()
+        saved = self._load_state()
 
         self._fd = LibC.inotify_init()
-        for alias, (path, flags) in self.requests.items():
-            self._setup_watch(alias, path, flags)
+        try:
+            self._open_recorder()
+            # Events found by rescans get queued before reading starts.
+            self._protocol = self._make_protocol(self._loop)
+            for alias, request in self.requests.items():
+                if request.recursive:
+                    self._setup_watch(alias, request.path, request.flags, recursive=True)
+            aliases = [alias for alias, request in self.requests.items() if not request.recursive]
+            errors = await self._register_watches(aliases)
+            if errors:
+                raise next(iter(errors.values()))
+
+            if saved is not None:
+                self._restore_fingerprints(saved)
+            self._schedule_snapshots()
+            if self._snapshot_task is not None:
+                # Wait for the initial snapshots.
+                await self._snapshot_task
+            if not self.rescan_on_overflow:
+                self._snapshots = {}
+
+            # We pass ownership of the fd to the transport; it will close it.
+            self._transport = await aioutils.connect_fd(
+                self._fd, self._protocol, self._loop, stats=self.stats, recorder=self._recorder,
+            )
+        except BaseException:
+            if self._snapshot_task is not None:
+                self._snapshot_task.cancel()
+            os.close(self._fd)
+            self._close_recorder()
+            self._reset()
+            raise
+        if self.max_watches is not None:
+            self._poll_task = self._loop.create_task(self._poll_directories())
+        if self.rescan_on_overflow:
+            self._refresh_task = self._loop.create_task(self._refresh_periodically())
 
-        # We pass ownership of the fd to the transport; it will close it.
-        self._stream, self._transport = await aioutils.stream_from_fd(self._fd, self._loop)
+    async def save_state(self, path=None):
+        """Save watches and directory fingerprints to ``path`` (``state_file`` by default).
+
+        Directories are scanned from a worker thread. Call this once done
+        with the events, typically right before close(): changes made in the
+        meantime would be neither delivered nor reported on the next setup().
+        """
+        path = self.state_file if path is None else path
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._write_state, path, dict(self.requests), self._fingerprint_paths())
 
     def close(self):
         """Schedule closure.
 
         This will close the transport and all related resources.
         """
+        if self._snapshot_task is not None:
+            self._snapshot_task.cancel()
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
         self._transport.close()
+        self._close_recorder()
         self._reset()
 
     @property
@@ -103,28 +1115,152 @@ class Watcher:
         """Are we closed?"""
         return self._transport is None
 
+    async def _wait_ready(self, timeout=None):
+        """Wait until events are ready for delivery.
+
+        Returns without any if the timeout expired, or if the watcher got closed.
+        """
+        protocol = self._protocol
+        if not self._stages:
+            try:
+                await asyncio.wait_for(protocol.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+            return
+
+        loop = self._loop
+        deadline = None if timeout is None else loop.time() + timeout
+        while not self._ready:
+            if self._protocol is not protocol:
+                # Closed meanwhile; held events are dropped along with the stages.
+                return
+            self._run_stages(loop.time())
+            if self._ready:
+                break
+            if protocol.closed:
+                # Flush all held events.
+                self._run_stages(math.inf)
+                break
+
+            wakeups = [stage.deadline() for stage in self._stages] + [deadline]
+            wakeups = [wakeup for wakeup in wakeups if wakeup is not None]
+            try:
+                if wakeups:
+                    await asyncio.wait_for(protocol.wait(), max(0, min(wakeups) - loop.time()))
+                else:
+                    await protocol.wait()
+            except asyncio.TimeoutError:
+                if deadline is not None and loop.time() >= deadline:
+                    self._run_stages(loop.time())
+                    break
+
     async def get_event(self):
         """Fetch an event.
 
         This coroutine will swallow events for removed watches.
         """
+        events = await self.get_events(max_events=1)
+        if not events:
+            # We got closed, return None.
+            return
+        return events[0]
+
+    async def get_events(self, max_events=None, timeout=None):
+        """Fetch all available events at once.
+
+        Waits until at least one event is available, then returns every
+        event already read from the kernel, up to ``max_events``.
+        Returns an empty list if ``timeout`` expires first, or if the
+        watcher gets closed.
+
+        This coroutine will swallow events for removed watches.
+        """
+        protocol = self._protocol
+        loop = self._loop
+        deadline = None if timeout is None else loop.time() + timeout
         while True:
-            prefix = await self._stream.readexactly(PREFIX.size)
-            if prefix == b'':
-                # We got closed, return None.
-                return
-            wd, flags, cookie, length = PREFIX.unpack(prefix)
-            path = await self._stream.readexactly(length)
+            await self._wait_ready(None if deadline is None else max(0, deadline - loop.time()))
+            if self._protocol is not protocol:
+                return []
+            if not self._stages:
+                events = protocol.take(max_events)
+            else:
+                events = aioutils.pop_events(self._ready, max_events)
+            # Events of a watch removed meanwhile may have been discarded: wait for more.
+            if events or protocol.closed or (deadline is not None and loop.time() >= deadline):
+                return self._deliver(events)
 
-            # All async performed, time to look at the event's content.
-            if wd not in self.aliases:
-                # Event for a removed watch, skip it.
-                continue
+    def on(self, alias_or_prefix, flags, callback):
+        """Register a handler, run by serve() on events matching an alias (or alias prefix) and flags.
 
-            decoded_path = struct.unpack('%ds' % length, path)[0].rstrip(b'\x00').decode('utf-8')
-            return Event(
-                flags=flags,
-                cookie=cookie,
-                name=decoded_path,
-                alias=self.aliases[wd],
-            )
+        ``alias_or_prefix`` matches that alias, and aliases below it, '/' being
+        the separator; ``''`` matches all aliases. Overflow events reach all
+        handlers. ``callback`` receives the event; it may be a coroutine function.
+        """
+        self._router.add(alias_or_prefix, flags, callback)
+
+    def off(self, alias_or_prefix, callback):
+        """Unregister a handler."""
+        self._router.remove(alias_or_prefix, callback)
+
+    async def serve(self, max_concurrency=100):
+        """Run the handlers registered with on(), until the watcher is closed.
+
+        Plain functions are called inline. Coroutines are run as tasks, at
+        most ``max_concurrency`` at once; past that, events wait for running
+        handlers to complete, and no ordering is guaranteed between them.
+        Handler exceptions are logged, and don't stop serving.
+        """
+        route = self._router.route
+        semaphore = asyncio.Semaphore(max_concurrency)
+        tasks = set()
+        try:
+            async for events in self.batches():
+                for event in events:
+                    for callback in route(event):
+                        try:
+                            result = callback(event)
+                        except Exception:
+                            logger.exception("Handler %r failed on %r", callback, event)
+                            continue
+                        if inspect.isawaitable(result):
+                            await semaphore.acquire()
+                            task = self._loop.create_task(self._run_handler(callback, event, result, semaphore))
+                            tasks.add(task)
+                            task.add_done_callback(tasks.discard)
+        except asyncio.CancelledError:
+            for task in tasks:
+                task.cancel()
+            raise
+        if tasks:
+            await asyncio.wait(list(tasks))
+
+    async def _run_handler(self, callback, event, awaitable, semaphore):
+        try:
+            await awaitable
+        except Exception:
+            logger.exception("Handler %r failed on %r", callback, event)
+        finally:
+            semaphore.release()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.closed:
+            raise StopAsyncIteration
+        event = await self.get_event()
+        if event is None:
+            raise StopAsyncIteration
+        return event
+
+    async def batches(self, max_events=None):
+        """Iterate over batches of events, as returned by get_events().
+
+        Usage: ``async for events in watcher.batches(): ...``
+        """
+        while not self.closed:
+            events = await self.get_events(max_events)
+            if not events:
+                return
+            yield events
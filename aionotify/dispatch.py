@@ -0,0 +1,133 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+import asyncio
+
+from .base import Watcher
+from .enums import KERNEL_FLAGS
+
+
+class Subscription:
+    """Interest of a Dispatcher subscriber in a path.
+
+    Matching events are delivered to the subscription's own queue.
+    """
+
+    def __init__(self, dispatcher, path, flags, filter=None):
+        self.dispatcher = dispatcher
+        self.path = path
+        self.flags = flags
+        self.filter = filter
+        self.queue = asyncio.Queue()
+
+    def matches(self, event):
+        if not event.flags & (self.flags | KERNEL_FLAGS):
+            return False
+        return self.filter is None or self.filter(event)
+
+    async def get_event(self):
+        """Fetch an event; returns None once the dispatcher is closed."""
+        return await self.queue.get()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self.get_event()
+        if event is None:
+            raise StopAsyncIteration
+        return event
+
+    def close(self):
+        """Stop receiving events."""
+        self.dispatcher.unsubscribe(self)
+
+    def __repr__(self):
+        return '<%s %s flags=%s>' % (self.__class__.__name__, self.path, self.flags)
+
+
+class Dispatcher:
+    """Share a single Watcher between many subscribers.
+
+    Subscribers register (path, flags, filter) interests; all interests in a
+    given path share one kernel watch, with the union of their flags. Each
+    event is decoded once, and routed to the subscriptions whose flags and
+    filter match it.
+    """
+
+    def __init__(self, watcher=None):
+        self.watcher = watcher or Watcher()
+        # path => list of subscriptions
+        self.subscriptions = {}
+        self._task = None
+
+    def subscribe(self, path, flags, filter=None):
+        """Register an interest in events on a path.
+
+        ``filter`` is an optional callable, receiving the event, which tells
+        whether to deliver it. Returns a Subscription.
+        """
+        subscription = Subscription(self, path, flags, filter)
+        subscriptions = self.subscriptions.get(path)
+        if not subscriptions:
+            try:
+                self.watcher.watch(path, flags, alias=path)
+            except OSError:
+                # Drop the request, so that the path may be subscribed again.
+                self.watcher.requests.pop(path, None)
+                raise
+            subscriptions = self.subscriptions[path] = []
+        elif flags & ~self.watcher.requests[path].flags:
+            self.watcher.set_flags(path, flags, add=True)
+        subscriptions.append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        """Remove a subscription; the kernel watch is narrowed or removed as needed."""
+        path = subscription.path
+        subscriptions = self.subscriptions[path]
+        subscriptions.remove(subscription)
+        if not subscriptions:
+            del self.subscriptions[path]
+            if path in self.watcher.descriptors:
+                self.watcher.unwatch(path)
+            else:
+                del self.watcher.requests[path]
+            return
+
+        flags = 0
+        for remaining in subscriptions:
+            flags |= remaining.flags
+        if flags != self.watcher.requests[path].flags:
+            self.watcher.set_flags(path, flags)
+
+    async def setup(self, loop=None):
+        """Start the underlying watcher, and routing events."""
+        await self.watcher.setup(loop)
+        self._task = asyncio.ensure_future(self._run(), loop=self.watcher._loop)
+
+    async def _run(self):
+        async for events in self.watcher.batches():
+            for event in events:
+                self._route(event)
+
+    def _route(self, event):
+        if event.is_overflow:
+            # Overflows concern all subscribers.
+            targets = [subscription for subscriptions in self.subscriptions.values() for subscription in subscriptions]
+        else:
+            targets = self.subscriptions.get(event.alias, ())
+        for subscription in targets:
+            if subscription.matches(event):
+                subscription.queue.put_nowait(event)
+
+    def close(self):
+        """Stop the watcher, and notify all subscribers."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if not self.watcher.closed:
+            self.watcher.close()
+        for subscriptions in self.subscriptions.values():
+            for subscription in subscriptions:
+                subscription.queue.put_nowait(None)
@@ -31,4 +31,64 @@ class Flags(enum.IntEnum):
 
     @classmethod
     def parse(cls, flags):
-        return [flag for flag in cls.__members__.values() if flag & flags]
+        """List the individual flags set in a mask, by increasing value."""
+        return list(_split(flags))
+
+    @classmethod
+    def split(cls, flags):
+        """Like parse(), as a shared tuple: repeated masks are served from a cache."""
+        return _split(flags)
+
+
+# Flags sent by the kernel even if not requested.
+KERNEL_FLAGS = Flags.IGNORED | Flags.Q_OVERFLOW | Flags.UNMOUNT
+
+# Plain int masks, for hot paths: looking up an enum member costs several times an int operation.
+ACCESS = int(Flags.ACCESS)
+MODIFY = int(Flags.MODIFY)
+CLOSE_WRITE = int(Flags.CLOSE_WRITE)
+CREATE = int(Flags.CREATE)
+DELETE = int(Flags.DELETE)
+MOVED_FROM = int(Flags.MOVED_FROM)
+MOVED_TO = int(Flags.MOVED_TO)
+MOVE = MOVED_FROM | MOVED_TO
+Q_OVERFLOW = int(Flags.Q_OVERFLOW)
+IGNORED = int(Flags.IGNORED)
+ISDIR = int(Flags.ISDIR)
+
+# _BYTE_TABLES[i][b] holds the flags set by value b in the i-th byte of a mask; built on first use.
+_BYTE_TABLES = None
+_SPLIT_CACHE = {}
+_SPLIT_CACHE_SIZE = 4096
+
+
+def _build_byte_tables():
+    members = [(int(flag), flag) for flag in Flags]
+    return tuple(
+        tuple(
+            tuple(flag for value, flag in members if (value >> (8 * i)) & 0xff & b)
+            for b in range(256)
+        )
+        for i in range(4)
+    )
+
+
+def _split(mask):
+    global _BYTE_TABLES
+    try:
+        return _SPLIT_CACHE[mask]
+    except KeyError:
+        pass
+    if _BYTE_TABLES is None:
+        _BYTE_TABLES = _build_byte_tables()
+    tables = _BYTE_TABLES
+    mask = int(mask)
+    flags = (
+        tables[0][mask & 0xff]
+        + tables[1][(mask >> 8) & 0xff]
+        + tables[2][(mask >> 16) & 0xff]
+        + tables[3][(mask >> 24) & 0xff]
+    )
+    if len(_SPLIT_CACHE) < _SPLIT_CACHE_SIZE:
+        _SPLIT_CACHE[mask] = flags
+    return flags
@@ -0,0 +1,144 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+import collections
+import sys
+
+from . import enums
+
+
+_FS_ENCODING = sys.getfilesystemencoding()
+_FS_ERRORS = sys.getfilesystemencodeerrors()
+
+
+class _FlagPredicates:
+    """Quick checks of an event's flags."""
+    __slots__ = ()
+
+    @property
+    def is_dir(self):
+        """Whether the event concerns a directory."""
+        return bool(self.flags & enums.ISDIR)
+
+    @property
+    def is_move(self):
+        """Whether the event is (part of) a rename."""
+        return bool(self.flags & enums.MOVE)
+
+    @property
+    def is_overflow(self):
+        """Whether the event reports a kernel queue overflow."""
+        return bool(self.flags & enums.Q_OVERFLOW)
+
+
+class Event(_FlagPredicates):
+    """An inotify event.
+
+    The name is kept as read from the kernel, and only decoded on first access
+    to ``name``; ``raw_name`` holds it as bytes. Undecodable bytes are mapped
+    to surrogates, as with ``os.fsdecode()``.
+
+    With ``Watcher(timestamps=True)``, ``timestamp`` holds the monotonic time
+    of the read returning the event; it is None otherwise.
+
+    For compatibility, events still behave as ``(flags, cookie, name, alias)``
+    tuples.
+    """
+
+    __slots__ = ('flags', 'cookie', 'alias', 'timestamp', '_raw', '_name')
+
+    _fields = ('flags', 'cookie', 'name', 'alias')
+
+    def __init__(self, flags, cookie, name, alias):
+        self.flags = flags
+        self.cookie = cookie
+        self.alias = alias
+        self.timestamp = None
+        # Raw names may still hold the kernel's trailing NUL padding.
+        if isinstance(name, bytes):
+            self._raw = name
+            self._name = None
+        else:
+            self._raw = None
+            self._name = name
+
+    @property
+    def raw_name(self):
+        raw = self._raw
+        if raw is None:
+            raw = self._raw = self._name.encode(_FS_ENCODING, _FS_ERRORS)
+        elif raw[-1:] == b'\x00':
+            raw = self._raw = raw.rstrip(b'\x00')
+        return raw
+
+    @property
+    def name(self):
+        name = self._name
+        if name is None:
+            name = self._name = self.raw_name.decode(_FS_ENCODING, _FS_ERRORS)
+        return name
+
+    # Tuple compatibility
+    # ===================
+
+    def __iter__(self):
+        return iter((self.flags, self.cookie, self.name, self.alias))
+
+    def __len__(self):
+        return 4
+
+    def __getitem__(self, index):
+        return tuple(self)[index]
+
+    def __eq__(self, other):
+        if isinstance(other, (Event, tuple)):
+            return tuple(self) == tuple(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __reduce__(self):
+        return (self.__class__, tuple(self))
+
+    def __repr__(self):
+        return '%s(flags=%r, cookie=%r, name=%r, alias=%r)' % (
+            self.__class__.__name__, self.flags, self.cookie, self.name, self.alias,
+        )
+
+    def _asdict(self):
+        return dict(zip(self._fields, self))
+
+    def _replace(self, **changes):
+        event = self.__class__(
+            changes.pop('flags', self.flags),
+            changes.pop('cookie', self.cookie),
+            changes.pop('name', self._raw if self._name is None else self._name),
+            changes.pop('alias', self.alias),
+        )
+        if changes:
+            raise ValueError("Got unexpected field names: %r" % list(changes))
+        event.timestamp = self.timestamp
+        return event
+
+
+_RenameTuple = collections.namedtuple('Rename', ['src_alias', 'src_name', 'dst_alias', 'dst_name', 'flags', 'cookie'])
+
+
+class Rename(_FlagPredicates, _RenameTuple):
+    """A MOVED_FROM / MOVED_TO pair, merged into a single event.
+
+    ``alias`` and ``name`` point to the destination, to be routed like an Event.
+    Renames carry no ``timestamp``.
+    """
+    __slots__ = ()
+
+    timestamp = None
+
+    @property
+    def alias(self):
+        return self.dst_alias
+
+    @property
+    def name(self):
+        return self.dst_name
@@ -0,0 +1,48 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+import fnmatch
+import os
+import re
+
+
+def compile_patterns(patterns):
+    """Compile glob patterns, or a regular expression, into a bytes regex.
+
+    ``patterns`` may be a glob pattern, a list of glob patterns, or a compiled
+    regular expression (str or bytes). Globs must match the whole name;
+    regular expressions are searched anywhere in it.
+    """
+    if patterns is None:
+        return None
+    if isinstance(patterns, re.Pattern):
+        if isinstance(patterns.pattern, bytes):
+            return patterns
+        return re.compile(os.fsencode(patterns.pattern), patterns.flags & ~re.UNICODE)
+    if isinstance(patterns, (str, bytes)):
+        patterns = [patterns]
+    return re.compile(b'|'.join(
+        b'\\A' + os.fsencode(fnmatch.translate(os.fsdecode(pattern)))
+        for pattern in patterns
+    ))
+
+
+class NameFilter:
+    """Select event names through include / exclude patterns.
+
+    Names are matched as raw bytes; a name is kept if it matches ``include``
+    (when set), and does not match ``exclude``.
+    """
+
+    __slots__ = ('include', 'exclude')
+
+    def __init__(self, include=None, exclude=None):
+        self.include = compile_patterns(include)
+        self.exclude = compile_patterns(exclude)
+
+    def __call__(self, name):
+        if self.include is not None and self.include.search(name) is None:
+            return False
+        if self.exclude is not None and self.exclude.search(name) is not None:
+            return False
+        return True
@@ -0,0 +1,96 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+"""Record raw inotify reads to a file.
+
+A recording starts with ``MAGIC``, followed by entries: an ``ENTRY`` header
+(kind, seconds since the start of the recording, payload size), then the
+payload. READ entries hold the bytes of a read from the kernel; WATCH entries
+hold a JSON (wd, alias, watch request, relative path) list, for each new
+kernel watch, so that replays can map descriptors to aliases.
+
+See aionotify.replay for replaying them.
+"""
+
+import mmap
+import struct
+import time
+
+from . import state
+
+MAGIC = b'AIONREC\x02'
+ENTRY = struct.Struct('<BdI')
+
+READ = 0
+WATCH = 1
+
+
+class Recorder:
+    """Append entries to a recording, through a memory map grown as needed."""
+
+    def __init__(self, path, chunk_size=1 << 20):
+        self.path = path
+        self.chunk_size = chunk_size
+        self._file = open(path, 'w+b')
+        self._file.truncate(chunk_size)
+        self._map = mmap.mmap(self._file.fileno(), chunk_size)
+        self._size = 0
+        self._start = time.monotonic()
+        self._append(MAGIC)
+
+    def _append(self, data):
+        end = self._size + len(data)
+        if end > len(self._map):
+            capacity = max(2 * len(self._map), end + self.chunk_size)
+            self._file.truncate(capacity)
+            self._map.resize(capacity)
+        self._map[self._size:end] = data
+        self._size = end
+
+    def _entry(self, kind, payload):
+        self._append(ENTRY.pack(kind, time.monotonic() - self._start, len(payload)))
+        self._append(payload)
+
+    def record_read(self, data):
+        """Record the bytes of a read from the kernel."""
+        self._entry(READ, data)
+
+    def record_watch(self, wd, alias, request, relpath):
+        """Record a new kernel watch; ``relpath`` is None unless it belongs to a recursive watch."""
+        import json
+
+        self._entry(WATCH, json.dumps([wd, *state.encode_request(alias, request), relpath]).encode('ascii'))
+
+    def close(self):
+        """Flush the recording, and trim it to its actual size."""
+        if self._map is None:
+            return
+        self._map.flush()
+        self._map.close()
+        self._map = None
+        self._file.truncate(self._size)
+        self._file.close()
+
+
+def decode_watch(payload):
+    """Decode the payload of a WATCH entry, into (wd, alias, request tuple, relative path)."""
+    import json
+
+    wd, *request, relpath = json.loads(bytes(payload))
+    alias, request = state.decode_request(request)
+    return wd, alias, request, relpath
+
+
+def read_recording(path):
+    """Iterate over the (kind, timestamp, payload) entries of a recording."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if not data.startswith(MAGIC):
+        raise ValueError("%s is not an aionotify recording" % path)
+    view = memoryview(data)
+    offset = len(MAGIC)
+    while offset + ENTRY.size <= len(data):
+        kind, timestamp, size = ENTRY.unpack_from(view, offset)
+        offset += ENTRY.size
+        yield kind, timestamp, view[offset:offset + size]
+        offset += size
@@ -0,0 +1,116 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+"""Replay recordings made with aionotify.record, without the kernel."""
+
+import asyncio
+
+from . import filters
+from . import record
+from .base import Watcher, WatchRequest
+
+
+class ReplayTransport(asyncio.ReadTransport):
+    """Feed the READ entries of a recording to a protocol.
+
+    With ``speed``, entries are replayed at that multiple of their recorded
+    pace; with ``speed=None``, as fast as possible. WATCH entries are passed
+    to ``on_watch(wd, alias, request, relpath)``.
+    """
+
+    def __init__(self, loop, path, protocol, on_watch, speed=1.0, stats=None):
+        super().__init__()
+        self.stats = stats
+        self._loop = loop
+        self._protocol = protocol
+        self._on_watch = on_watch
+        self._speed = speed
+        self._reading = asyncio.Event()
+        self._reading.set()
+        self._protocol.connection_made(self)
+        self._task = loop.create_task(self._replay(path))
+
+    async def _replay(self, path):
+        start = self._loop.time()
+        try:
+            for kind, timestamp, payload in record.read_recording(path):
+                if self._speed is None:
+                    await asyncio.sleep(0)
+                else:
+                    await asyncio.sleep(start + timestamp / self._speed - self._loop.time())
+                await self._reading.wait()
+                if kind == record.READ:
+                    if self.stats is not None:
+                        self.stats.record_read(len(payload))
+                    self._protocol.data_received(payload)
+                elif kind == record.WATCH:
+                    self._on_watch(*record.decode_watch(payload))
+            self._protocol.eof_received()
+        finally:
+            self._protocol.connection_lost(None)
+
+    def pause_reading(self):
+        self._reading.clear()
+
+    def resume_reading(self):
+        self._reading.set()
+
+    def close(self):
+        self._task.cancel()
+
+    def is_closing(self):
+        return self._task.done()
+
+
+class ReplayWatcher(Watcher):
+    """A Watcher reading events from a recording instead of the kernel.
+
+    Events go through the same decoding and processing stages; the aliases
+    and watch options come from the recording. Directories are never
+    accessed: synthetic events for the content of new directories, and
+    rescans, are not replayed.
+    """
+
+    def __init__(self, path, *, speed=1.0, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self.speed = speed
+
+    def watch(self, path, flags, *, alias=None, recursive=False, include=None, exclude=None):
+        raise TypeError("Watches of a ReplayWatcher come from its recording.")
+
+    async def setup(self, loop=None):
+        """Start replaying."""
+        self._loop = loop or asyncio.get_running_loop()
+        self._protocol = self._make_protocol(self._loop)
+        self._transport = ReplayTransport(
+            self._loop, self.path, self._protocol, self._replay_watch, speed=self.speed, stats=self.stats,
+        )
+
+    def _replay_watch(self, wd, alias, request, relpath):
+        if alias not in self.requests:
+            request = WatchRequest(*request)
+            self.requests[alias] = request
+            if request.include is not None or request.exclude is not None:
+                self._filters[alias] = filters.NameFilter(request.include, request.exclude)
+        self.aliases[wd] = alias
+        if relpath is None or relpath == '':
+            self.descriptors[alias] = wd
+        if relpath == '':
+            self._trees[alias] = {}
+        if relpath is not None:
+            self._subdirs[wd] = relpath
+            self._trees[alias][relpath] = wd
+
+    # Directories are only known through the recording.
+    def _add_subdir(self, alias, relpath, evict=False):
+        return False
+
+    def _add_subtree(self, alias, relpath):
+        return []
+
+    def _remove_subdir(self, wd):
+        del self.aliases[wd]
+
+    def _schedule_snapshots(self):
+        pass
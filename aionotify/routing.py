@@ -0,0 +1,77 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+"""Route events to handlers, by alias and flags."""
+
+from .enums import KERNEL_FLAGS
+
+
+def _prefixes(alias):
+    """Keys whose handlers apply to an alias: itself, and each of its '/'-separated prefixes.
+
+    Only string aliases have prefixes; others are matched exactly.
+    """
+    keys = {alias, ''}
+    if not isinstance(alias, str):
+        return keys
+    index = alias.find('/')
+    while index >= 0:
+        keys.add(alias[:index])
+        keys.add(alias[:index + 1])
+        index = alias.find('/', index + 1)
+    return keys
+
+
+class Router:
+    """A table of (alias or prefix, flags mask, callback) handlers.
+
+    A handler registered for ``'/srv/app'`` gets events of that alias, and of
+    aliases below it, such as ``'/srv/app/logs'``; ``''`` matches all aliases.
+    Other aliases, such as tuples, only match handlers registered for them.
+    Overflow events, which have no alias, reach all handlers.
+
+    The handlers of each alias are resolved once, on its first event: routing
+    an event is then a dict lookup, and a mask test per handler of its alias.
+    """
+
+    def __init__(self):
+        # Entries are (key, mask, callback), in registration order.
+        self._handlers = []
+        # alias => tuple of (mask, callback)
+        self._routes = {}
+
+    def __bool__(self):
+        return bool(self._handlers)
+
+    def add(self, key, mask, callback):
+        # Flags sent by the kernel reach all matching handlers.
+        self._handlers.append((key, mask | KERNEL_FLAGS, callback))
+        self._routes.clear()
+
+    def remove(self, key, callback):
+        handlers = [entry for entry in self._handlers if entry[0] != key or entry[2] != callback]
+        if len(handlers) == len(self._handlers):
+            raise ValueError("No handler %r registered for %r" % (callback, key))
+        self._handlers = handlers
+        self._routes.clear()
+
+    def forget(self, alias):
+        """Drop the resolved handlers of a removed alias."""
+        self._routes.pop(alias, None)
+
+    def _resolve(self, alias):
+        if alias is None:
+            handlers = self._handlers
+        else:
+            keys = _prefixes(alias)
+            handlers = [entry for entry in self._handlers if entry[0] in keys]
+        return tuple((mask, callback) for _key, mask, callback in handlers)
+
+    def route(self, event):
+        """Return the callbacks interested in an event."""
+        alias = event.alias
+        routes = self._routes.get(alias)
+        if routes is None:
+            routes = self._routes[alias] = self._resolve(alias)
+        flags = event.flags
+        return [callback for mask, callback in routes if flags & mask]
@@ -0,0 +1,256 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+import asyncio
+import collections
+import concurrent.futures
+import os
+import threading
+
+from . import aioutils
+from . import state
+from .base import Watcher
+
+
+class ShardedWatcher:
+    """Spread watches over several inotify instances.
+
+    Each shard is a Watcher, running its own event loop in a worker thread;
+    a watch goes to the shard picked by hashing its alias. Shards forward
+    their events, in batches, to a single queue consumed on the caller's
+    loop: ordering is preserved for each alias, not across aliases.
+
+    That queue holds at most one batch per shard; beyond that, shards stop
+    forwarding, and their own queue applies ``max_queue`` and ``queue_policy``.
+
+    Once started, ``watch()`` and ``unwatch()`` block the calling thread until
+    the shard has updated its watches; from an event loop, prefer the
+    ``watch_many()`` and ``unwatch_many()`` coroutines.
+
+    With ``state_file``, the state file is loaded once by ``setup()``, each
+    saved watch going to its shard; ``save_state()`` saves those of all shards.
+
+    Extra keyword arguments are passed to each shard's Watcher, except for
+    ``record_file``: recordings hold the reads of a single inotify instance.
+    """
+
+    def __init__(self, shards=None, state_file=None, **watcher_kwargs):
+        if watcher_kwargs.get('record_file') is not None:
+            raise ValueError("ShardedWatcher does not support record_file; record each Watcher separately")
+        if shards is None:
+            shards = os.cpu_count() or 1
+        self.state_file = state_file
+        self.shards = [Watcher(**watcher_kwargs) for _i in range(shards)]
+        self._loop = None
+        self._shard_loops = {}
+        self._shard_tasks = {}
+        self._threads = []
+        self._batches = None
+        self._closing = None
+        self._events = collections.deque()
+        self._closed = False
+
+    def shard_for(self, alias):
+        """The Watcher handling a given alias."""
+        return self.shards[hash(alias) % len(self.shards)]
+
+    def _call(self, shard, func, *args, **kwargs):
+        """Run a function in the thread of a shard, once started; block until its result."""
+        loop = self._shard_loops.get(shard)
+        if loop is None:
+            return func(*args, **kwargs)
+        future = concurrent.futures.Future()
+
+        def run():
+            try:
+                future.set_result(func(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+        loop.call_soon_threadsafe(run)
+        return future.result()
+
+    def watch(self, path, flags, *, alias=None, **kwargs):
+        """Add a new watching rule; see Watcher.watch()."""
+        if alias is None:
+            alias = path
+        shard = self.shard_for(alias)
+        self._call(shard, shard.watch, path, flags, alias=alias, **kwargs)
+
+    def unwatch(self, alias):
+        """Stop watching a given rule."""
+        shard = self.shard_for(alias)
+        self._call(shard, shard.unwatch, alias)
+
+    async def _call_many(self, method, items, alias):
+        """Split items between shards, by ``alias(item)``; await ``method(shard, items)`` for each.
+
+        Once started, each call runs in the thread of its shard. Returns the
+        merged {alias: exception} dicts.
+        """
+        batches = collections.defaultdict(list)
+        for item in items:
+            batches[self.shard_for(alias(item))].append(item)
+        calls = []
+        for shard, batch in batches.items():
+            loop = self._shard_loops.get(shard)
+            if loop is None:
+                calls.append(method(shard, batch))
+            else:
+                calls.append(asyncio.wrap_future(asyncio.run_coroutine_threadsafe(method(shard, batch), loop)))
+        errors = {}
+        for shard_errors in await asyncio.gather(*calls):
+            errors.update(shard_errors)
+        return errors
+
+    async def watch_many(self, watches):
+        """Add a batch of (path, flags, alias) watching rules; see Watcher.watch_many()."""
+        watches = [(path, flags, path if alias is None else alias) for path, flags, alias in watches]
+        return await self._call_many(Watcher.watch_many, watches, lambda watch: watch[2])
+
+    async def unwatch_many(self, aliases):
+        """Remove a batch of watching rules; see Watcher.unwatch_many()."""
+        return await self._call_many(Watcher.unwatch_many, aliases, lambda alias: alias)
+
+    @property
+    def requests(self):
+        requests = {}
+        for shard in self.shards:
+            requests.update(shard.requests)
+        return requests
+
+    async def setup(self, loop=None):
+        """Start all shards, each in its own thread."""
+        self._loop = loop or asyncio.get_running_loop()
+        if self.state_file is not None:
+            self._split_state()
+        self._batches = asyncio.Queue(len(self.shards))
+        self._closing = self._loop.create_future()
+        started = []
+        for index, shard in enumerate(self.shards):
+            future = self._loop.create_future()
+            thread = threading.Thread(
+                target=self._run_shard,
+                args=(shard, future),
+                name='aionotify-shard-%d' % index,
+                daemon=True,
+            )
+            thread.start()
+            self._threads.append(thread)
+            started.append(future)
+        results = await asyncio.gather(*started, return_exceptions=True)
+        errors = [result for result in results if isinstance(result, BaseException)]
+        if errors:
+            # Stop the shards which did start.
+            self.close()
+            raise errors[0]
+
+    def _split_state(self):
+        """Hand the saved watches and fingerprints over to their shards."""
+        try:
+            requests, fingerprints = state.load(self.state_file)
+        except FileNotFoundError:
+            return
+        parts = {shard: ({}, {}) for shard in self.shards}
+        for alias, request in requests.items():
+            parts[self.shard_for(alias)][0][alias] = request
+        for key, entries in fingerprints.items():
+            parts[self.shard_for(key[0])][1][key] = entries
+        for shard, part in parts.items():
+            shard._saved_state = part
+
+    async def save_state(self, path=None):
+        """Save the watches and directory fingerprints of all shards; see Watcher.save_state()."""
+        path = self.state_file if path is None else path
+
+        async def collect(shard):
+            return dict(shard.requests), shard._fingerprint_paths()
+
+        requests = {}
+        paths = {}
+        for shard in self.shards:
+            loop = self._shard_loops.get(shard)
+            if loop is None:
+                result = await collect(shard)
+            else:
+                result = await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(collect(shard), loop))
+            requests.update(result[0])
+            paths.update(result[1])
+        await asyncio.get_running_loop().run_in_executor(None, Watcher._write_state, path, requests, paths)
+
+    def _run_shard(self, shard, started):
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(self._shard_main(shard, started))
+        finally:
+            loop.close()
+
+    async def _shard_main(self, shard, started):
+        try:
+            await shard.setup()
+        except Exception as e:
+            self._loop.call_soon_threadsafe(started.set_exception, e)
+            return
+        self._shard_loops[shard] = asyncio.get_running_loop()
+        self._shard_tasks[shard] = asyncio.current_task()
+        self._loop.call_soon_threadsafe(started.set_result, None)
+
+        try:
+            async for events in shard.batches():
+                # Wait for room in the merged queue: meanwhile, events pile up in the shard's queue.
+                await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(self._batches.put(events), self._loop))
+        except asyncio.CancelledError:
+            # Closed from the caller's thread.
+            pass
+        finally:
+            if not shard.closed:
+                shard.close()
+
+    def close(self):
+        """Close all shards; their threads exit once done."""
+        self._closed = True
+        for shard, loop in self._shard_loops.items():
+            loop.call_soon_threadsafe(self._shard_tasks[shard].cancel)
+        self._shard_loops = {}
+        self._shard_tasks = {}
+        if self._closing is not None and not self._closing.done():
+            # Wake up all readers.
+            self._closing.set_result(None)
+
+    @property
+    def closed(self):
+        return self._closed
+
+    async def get_events(self, max_events=None, timeout=None):
+        """Fetch available events from all shards; see Watcher.get_events()."""
+        if not self._events and not self._closed:
+            getter = asyncio.ensure_future(self._batches.get())
+            try:
+                done, _pending = await asyncio.wait(
+                    [getter, self._closing], timeout=timeout, return_when=asyncio.FIRST_COMPLETED,
+                )
+            finally:
+                if not getter.done():
+                    getter.cancel()
+            if getter not in done:
+                # Timed out, or closed.
+                return []
+            self._events.extend(getter.result())
+            while not self._batches.empty():
+                self._events.extend(self._batches.get_nowait())
+
+        return aioutils.pop_events(self._events, max_events)
+
+    async def get_event(self):
+        """Fetch an event; returns None once closed."""
+        events = await self.get_events(max_events=1)
+        return events[0] if events else None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self.get_event()
+        if event is None:
+            raise StopAsyncIteration
+        return event
@@ -0,0 +1,62 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+"""Directory snapshots, to find changes missed by inotify."""
+
+import os
+import stat
+
+from .enums import Flags
+
+
+def scan(path):
+    """Snapshot the content of a directory.
+
+    Returns a {name: (inode, mtime_ns, size, is_dir)} dict.
+    """
+    entries = {}
+    with os.scandir(path) as it:
+        for entry in it:
+            try:
+                st = entry.stat(follow_symlinks=False)
+            except OSError:
+                # Removed in the meantime.
+                continue
+            entries[entry.name] = (st.st_ino, st.st_mtime_ns, st.st_size, stat.S_ISDIR(st.st_mode))
+    return entries
+
+
+def scan_all(paths):
+    """Snapshot a set of directories, from a {key: path} dict.
+
+    Returns a {key: snapshot} dict; directories which could not be read are skipped.
+    """
+    snapshots = {}
+    for key, path in paths.items():
+        try:
+            snapshots[key] = scan(path)
+        except OSError:
+            continue
+    return snapshots
+
+
+def diff(old, new):
+    """List changes between two snapshots of a directory, as (name, flags) pairs.
+
+    A name now pointing to another inode is reported as deleted, then created.
+    """
+    changes = []
+    for name, (inode, mtime, size, is_dir) in new.items():
+        isdir = Flags.ISDIR if is_dir else 0
+        previous = old.get(name)
+        if previous is None:
+            changes.append((name, Flags.CREATE | isdir))
+        elif previous[0] != inode:
+            changes.append((name, Flags.DELETE | (Flags.ISDIR if previous[3] else 0)))
+            changes.append((name, Flags.CREATE | isdir))
+        elif previous[1:3] != (mtime, size) and not is_dir:
+            changes.append((name, Flags.MODIFY))
+    for name, previous in old.items():
+        if name not in new:
+            changes.append((name, Flags.DELETE | (Flags.ISDIR if previous[3] else 0)))
+    return changes
@@ -0,0 +1,243 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+"""Processing stages, run on decoded events before their delivery.
+
+A stage receives batches of events through ``feed(events, now)``, and returns
+the events ready to move on; it may hold some back until ``deadline()``.
+Feeding a stage with ``now=math.inf`` flushes everything it holds.
+"""
+
+import collections
+import concurrent.futures
+import math
+import os
+
+from . import enums
+from .events import Rename
+
+
+class Coalescer:
+    """Merge events for the same (alias, name) within a time window.
+
+    The window opens with the first event for a name; when it closes, a single
+    event is emitted for that name, with the flags of all merged events.
+
+    Renames are never merged.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        # (alias, name) => [first event, merged flags, deadline]
+        self._pending = collections.OrderedDict()
+
+    def feed(self, events, now):
+        pending = self._pending
+        for event in events:
+            key = event if isinstance(event, Rename) else (event.alias, event.raw_name)
+            entry = pending.get(key)
+            if entry is None:
+                pending[key] = [event, event.flags, now + self.window]
+            else:
+                entry[1] |= event.flags
+
+        # All windows have the same duration: deadlines follow insertion order.
+        ready = []
+        while pending:
+            event, flags, deadline = next(iter(pending.values()))
+            if deadline > now:
+                break
+            pending.popitem(last=False)
+            ready.append(event._replace(flags=flags) if flags != event.flags else event)
+        return ready
+
+    def deadline(self):
+        if not self._pending:
+            return None
+        return next(iter(self._pending.values()))[2]
+
+    def discard(self, predicate):
+        """Drop all held events matching a predicate."""
+        for key, entry in list(self._pending.items()):
+            if predicate(entry[0]):
+                del self._pending[key]
+
+
+class RenamePairer:
+    """Merge MOVED_FROM / MOVED_TO events sharing a cookie into a Rename.
+
+    A MOVED_FROM waits up to ``timeout`` for its MOVED_TO, holding back the
+    events following it so that ordering is preserved; unmatched halves are
+    emitted as is.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        # Entries are [event, deadline]; the deadline is None once resolved.
+        self._held = collections.deque()
+        # cookie => entry of the pending MOVED_FROM
+        self._moves = {}
+
+    def feed(self, events, now):
+        held = self._held
+        moves = self._moves
+        for event in events:
+            flags = event.flags
+            if flags & enums.MOVED_FROM:
+                entry = [event, now + self.timeout]
+                moves[event.cookie] = entry
+                held.append(entry)
+            elif flags & enums.MOVED_TO and event.cookie in moves:
+                entry = moves.pop(event.cookie)
+                source = entry[0]
+                entry[0] = Rename(
+                    source.alias, source.name, event.alias, event.name, source.flags | flags, event.cookie,
+                )
+                entry[1] = None
+            else:
+                held.append([event, None])
+
+        ready = []
+        while held:
+            event, deadline = held[0]
+            if deadline is not None:
+                if deadline > now:
+                    break
+                # No matching MOVED_TO.
+                del moves[event.cookie]
+            held.popleft()
+            ready.append(event)
+        return ready
+
+    def deadline(self):
+        if not self._held:
+            return None
+        return self._held[0][1]
+
+    def discard(self, predicate):
+        """Drop all held events matching a predicate."""
+        self._held = collections.deque(entry for entry in self._held if not predicate(entry[0]))
+        self._moves = {cookie: entry for cookie, entry in self._moves.items() if not predicate(entry[0])}
+
+
+_hash_executor = None
+
+
+def _default_executor():
+    """A small thread pool, shared by all content verifiers."""
+    global _hash_executor
+    if _hash_executor is None:
+        _hash_executor = concurrent.futures.ThreadPoolExecutor(max_workers=2, thread_name_prefix='aionotify-hash')
+    return _hash_executor
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """Fast digest of a file's content; None if it can't be read."""
+    import hashlib
+
+    digest = hashlib.blake2b(digest_size=16)
+    try:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.digest()
+
+
+class ContentVerifier:
+    """Drop CLOSE_WRITE events for files whose content did not change.
+
+    ``resolve(event)`` returns the path of an event's file, or None. Files are
+    fingerprinted by (inode, size, mtime_ns); when only their mtime changed,
+    their content is hashed from ``executor``, and compared with the previous
+    digest. The first CLOSE_WRITE seen for a file always goes through.
+
+    Up to ``cache_size`` files are remembered, the least recently used being
+    forgotten first. Events wait for pending hashes, preserving ordering.
+    """
+
+    #: While hashes are pending, check for their completion that often (in seconds).
+    poll_interval = 0.01
+
+    def __init__(self, resolve, cache_size=10000, executor=None):
+        self._resolve = resolve
+        self.cache_size = cache_size
+        self._executor = executor
+        # path => (inode, size, mtime_ns, digest or None)
+        self._cache = collections.OrderedDict()
+        # Entries are [event, verdict]: True / False, or a (future, path, fingerprint, previous digest) tuple.
+        self._held = collections.deque()
+        self._now = 0
+        #: Number of events dropped as unchanged.
+        self.unchanged = 0
+
+    def _remember(self, path, fingerprint):
+        cache = self._cache
+        cache[path] = fingerprint
+        cache.move_to_end(path)
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
+
+    def _check(self, event):
+        """Whether to deliver an event; may return a pending hash instead."""
+        flags = event.flags
+        if flags & enums.ISDIR or not flags & (enums.CLOSE_WRITE | enums.DELETE | enums.MOVE):
+            return True
+        path = self._resolve(event)
+        if path is None:
+            return True
+        if not flags & enums.CLOSE_WRITE:
+            # Deleted, or replaced.
+            self._cache.pop(path, None)
+            return True
+
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._cache.pop(path, None)
+            return True
+        cached = self._cache.get(path)
+        if cached is None or cached[:2] != (st.st_ino, st.st_size):
+            self._remember(path, (st.st_ino, st.st_size, st.st_mtime_ns, None))
+            return True
+        if cached[2] == st.st_mtime_ns:
+            self._cache.move_to_end(path)
+            return False
+
+        # Same file and size, written again: compare the content.
+        executor = self._executor or _default_executor()
+        future = executor.submit(hash_file, path)
+        return (future, path, (st.st_ino, st.st_size, st.st_mtime_ns), cached[3])
+
+    def feed(self, events, now):
+        self._now = now
+        held = self._held
+        for event in events:
+            held.append([event, self._check(event)])
+
+        ready = []
+        while held:
+            event, verdict = held[0]
+            if verdict.__class__ is tuple:
+                future, path, fingerprint, previous = verdict
+                if not future.done() and now != math.inf:
+                    break
+                digest = future.result()
+                self._remember(path, fingerprint + (digest,))
+                verdict = digest is None or digest != previous
+            held.popleft()
+            if verdict:
+                ready.append(event)
+            else:
+                self.unchanged += 1
+        return ready
+
+    def deadline(self):
+        if not self._held:
+            return None
+        return self._now + self.poll_interval
+
+    def discard(self, predicate):
+        """Drop all held events matching a predicate."""
+        self._held = collections.deque(entry for entry in self._held if not predicate(entry[0]))
@@ -0,0 +1,100 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+"""Persist watch requests and directory fingerprints across restarts.
+
+State files are compressed JSON. Aliases must be JSON values; lists come
+back as tuples. Compiled include / exclude patterns are saved as their
+pattern and flags.
+"""
+
+import os
+import re
+import zlib
+
+FORMAT_VERSION = 2
+
+
+def _encode_patterns(patterns):
+    """Encode include / exclude patterns: globs as strings, regular expressions as a dict."""
+    if patterns is None:
+        return None
+    if isinstance(patterns, re.Pattern):
+        return {
+            'pattern': os.fsdecode(patterns.pattern),
+            'flags': patterns.flags,
+            'bytes': isinstance(patterns.pattern, bytes),
+        }
+    if isinstance(patterns, (str, bytes)):
+        return os.fsdecode(patterns)
+    return [os.fsdecode(pattern) for pattern in patterns]
+
+
+def _decode_patterns(patterns):
+    if isinstance(patterns, dict):
+        pattern = patterns['pattern']
+        if patterns['bytes']:
+            pattern = os.fsencode(pattern)
+        return re.compile(pattern, patterns['flags'])
+    return patterns
+
+
+def _decode_alias(alias):
+    if isinstance(alias, list):
+        return tuple(_decode_alias(item) for item in alias)
+    return alias
+
+
+def encode_request(alias, request):
+    """Encode an alias and its watch request, as a JSON-compatible list."""
+    path, flags, recursive, include, exclude = request
+    return [alias, os.fsdecode(path), int(flags), recursive, _encode_patterns(include), _encode_patterns(exclude)]
+
+
+def decode_request(data):
+    """Decode the output of encode_request(); return the alias and the request tuple."""
+    alias, path, flags, recursive, include, exclude = data
+    return _decode_alias(alias), (path, flags, recursive, _decode_patterns(include), _decode_patterns(exclude))
+
+
+def dump(path, requests, fingerprints):
+    """Atomically write a state file.
+
+    ``requests`` maps aliases to watch requests (tuples), ``fingerprints``
+    maps (alias, relative path) keys to directory snapshots.
+    """
+    import json
+
+    data = {
+        'version': FORMAT_VERSION,
+        'requests': [encode_request(alias, request) for alias, request in requests.items()],
+        'fingerprints': [[alias, relpath, entries] for (alias, relpath), entries in fingerprints.items()],
+    }
+    payload = zlib.compress(json.dumps(data).encode('ascii'))
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+def load(path):
+    """Read a state file; return its (requests, fingerprints)."""
+    import json
+
+    with open(path, 'rb') as f:
+        payload = f.read()
+    try:
+        data = json.loads(zlib.decompress(payload))
+    except (zlib.error, ValueError) as e:
+        raise ValueError("Invalid state file %s: %s" % (path, e))
+    if not isinstance(data, dict) or data.get('version') != FORMAT_VERSION:
+        raise ValueError("Unsupported state file %s" % path)
+    try:
+        requests = dict(decode_request(request) for request in data['requests'])
+        fingerprints = {
+            (_decode_alias(alias), relpath): {name: tuple(entry) for name, entry in entries.items()}
+            for alias, relpath, entries in data['fingerprints']
+        }
+    except (KeyError, TypeError, ValueError, re.error) as e:
+        raise ValueError("Invalid state file %s: %s" % (path, e))
+    return requests, fingerprints
@@ -0,0 +1,153 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+"""Opt-in metrics for watchers.
+
+A Stats object is shared by a Watcher, its protocol and its transport; each
+of them only records into it when one was provided, so that disabled metrics
+cost a single ``is None`` check on the hot path.
+"""
+
+import bisect
+import time
+
+
+class Histogram:
+    """A latency histogram, with exponential buckets from 1µs to ~1min."""
+
+    __slots__ = ('bounds', 'counts', 'count', 'total', 'max')
+
+    #: Upper bound of each bucket, in seconds; the last bucket is unbounded.
+    default_bounds = tuple(1e-6 * 2 ** i for i in range(26))
+
+    def __init__(self, bounds=None):
+        self.bounds = self.default_bounds if bounds is None else tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value, weight=1):
+        self.counts[bisect.bisect_left(self.bounds, value)] += weight
+        self.count += weight
+        self.total += value * weight
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, fraction):
+        """Upper bound of the bucket holding the given fraction of values."""
+        if not self.count:
+            return None
+        rank = fraction * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else None,
+            'p50': self.percentile(0.5),
+            'p99': self.percentile(0.99),
+            'max': self.max,
+        }
+
+
+class Stats:
+    """Counters and latency histograms for a watcher.
+
+    Hooks registered with ``add_hook()`` are called as ``hook(name, value)``
+    for each recorded measure:
+
+    - ``'read'``: bytes returned by a read from the kernel;
+    - ``'events'``: number of events decoded from that read;
+    - ``'unknown_watch'``: an event for an already removed watch was skipped;
+    - ``'overflow'``: the kernel queue overflowed;
+    - ``'queue_dropped'``: number of events dropped by a full event queue;
+    - ``'latency'``: seconds between reading a batch of events and handing it
+      to the consumer, before any coalescing or rename pairing window.
+    """
+
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self):
+        self.started = self.clock()
+        self.reads = 0
+        self.bytes_read = 0
+        self.events = 0
+        self.delivered = 0
+        self.unknown_watch = 0
+        self.overflows = 0
+        self.queue_dropped = 0
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.latency = Histogram()
+        self._hooks = []
+
+    def add_hook(self, hook):
+        self._hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self._hooks.remove(hook)
+
+    def _notify(self, name, value):
+        for hook in self._hooks:
+            hook(name, value)
+
+    def record_read(self, nbytes):
+        self.reads += 1
+        self.bytes_read += nbytes
+        if self._hooks:
+            self._notify('read', nbytes)
+
+    def record_events(self, count, queue_depth):
+        self.events += count
+        self.queue_depth = queue_depth
+        if queue_depth > self.max_queue_depth:
+            self.max_queue_depth = queue_depth
+        if self._hooks:
+            self._notify('events', count)
+
+    def record_unknown_watch(self):
+        self.unknown_watch += 1
+        if self._hooks:
+            self._notify('unknown_watch', 1)
+
+    def record_overflow(self):
+        self.overflows += 1
+        if self._hooks:
+            self._notify('overflow', 1)
+
+    def record_queue_dropped(self, count):
+        self.queue_dropped += count
+        if self._hooks:
+            self._notify('queue_dropped', count)
+
+    def record_delivery(self, count, latency, queue_depth):
+        self.delivered += count
+        self.queue_depth = queue_depth
+        self.latency.add(latency, count)
+        if self._hooks:
+            self._notify('latency', latency)
+
+    def snapshot(self):
+        """Return the current values, as a dict."""
+        elapsed = self.clock() - self.started
+        return {
+            'elapsed': elapsed,
+            'reads': self.reads,
+            'bytes_read': self.bytes_read,
+            'bytes_per_read': self.bytes_read / self.reads if self.reads else None,
+            'events': self.events,
+            'events_per_second': self.events / elapsed if elapsed > 0 else None,
+            'delivered': self.delivered,
+            'unknown_watch': self.unknown_watch,
+            'overflows': self.overflows,
+            'queue_dropped': self.queue_dropped,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'latency': self.latency.snapshot(),
+        }
@@ -0,0 +1,186 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+import os
+import select
+import time
+
+from . import aioutils
+from . import snapshot
+from .base import BaseWatcher, LibC
+
+
+class SyncWatcher(BaseWatcher):
+    """Watch a set of paths from a plain thread, without an event loop.
+
+    Options are those of Watcher; events are fetched with the blocking
+    ``read_events()``. A SyncWatcher must only be used from one thread
+    at a time.
+    """
+
+    clock = staticmethod(time.monotonic)
+
+    def _reset(self):
+        super()._reset()
+        self._epoll = None
+        self._reading = False
+        self._next_poll = None
+        self._next_refresh = None
+
+    def setup(self):
+        """Start the watcher, registering new watches if any."""
+        saved = self._load_state()
+        self._fd = LibC.inotify_init()
+        try:
+            self._open_recorder()
+            self._protocol = self._make_protocol(None)
+            # We stand in for the transport, for backpressure.
+            self._protocol.connection_made(self)
+            for alias, request in self.requests.items():
+                self._setup_watch(alias, request.path, request.flags, recursive=request.recursive)
+
+            if saved is not None:
+                self._restore_fingerprints(saved)
+            self._run_snapshots()
+            if not self.rescan_on_overflow:
+                self._snapshots = {}
+            self._epoll = select.epoll()
+            self._epoll.register(self._fd, select.EPOLLIN)
+        except BaseException:
+            self.close()
+            raise
+        self._reading = True
+        if self.max_watches is not None:
+            self._next_poll = self.clock() + self.poll_interval
+        if self.rescan_on_overflow:
+            self._next_refresh = self.clock() + self.refresh_interval
+
+    def close(self):
+        """Close the inotify instance."""
+        if self._epoll is not None:
+            self._epoll.close()
+        if self._fd is not None:
+            os.close(self._fd)
+        self._close_recorder()
+        self._reset()
+
+    def save_state(self, path=None):
+        """Save watches and directory fingerprints to ``path`` (``state_file`` by default); see Watcher."""
+        path = self.state_file if path is None else path
+        self._write_state(path, self.requests, self._fingerprint_paths())
+
+    @property
+    def closed(self):
+        """Are we closed?"""
+        return self._fd is None
+
+    def watch_many(self, watches):
+        """Add a batch of (path, flags, alias) watching rules.
+
+        Failures do not abort the batch: they are returned, as an
+        {alias: exception} dict.
+        """
+        errors = {}
+        for path, flags, alias in watches:
+            alias = path if alias is None else alias
+            try:
+                self.watch(path, flags, alias=alias)
+            except ValueError as e:
+                errors[alias] = e
+            except OSError as e:
+                self._drop_request(alias)
+                errors[alias] = e
+        return errors
+
+    def unwatch_many(self, aliases):
+        """Remove a batch of watching rules; failures are returned as an {alias: exception} dict."""
+        errors = {}
+        for alias in aliases:
+            try:
+                self.unwatch(alias)
+            except (OSError, ValueError) as e:
+                errors[alias] = e
+        return errors
+
+    # Transport interface, called by the protocol when its queue fills up.
+    def pause_reading(self):
+        self._reading = False
+
+    def resume_reading(self):
+        self._reading = True
+
+    def _schedule_snapshots(self):
+        # Pending snapshots are taken on the next call to read_events().
+        pass
+
+    def _run_snapshots(self):
+        while self._rescan_requested or self._unsnapshotted:
+            rescan, paths = self._pending_snapshots()
+            self._store_snapshots(rescan, snapshot.scan_all(paths))
+
+    def _poll_directories(self):
+        paths = self._poll_paths()
+        self._store_polls(paths, snapshot.scan_all(paths))
+        self._next_poll = self.clock() + self.poll_interval
+
+    def _read(self, timeout):
+        """Wait up to ``timeout`` seconds (forever if None) for the fd, then read once from it."""
+        if not self._reading:
+            return
+        if not self._epoll.poll(-1 if timeout is None else timeout):
+            return
+        buf = self._protocol.get_buffer(-1)
+        try:
+            nbytes = os.readv(self._fd, [buf])
+        except (BlockingIOError, InterruptedError):
+            return
+        if self.stats is not None:
+            self.stats.record_read(nbytes)
+        if self._recorder is not None:
+            self._recorder.record_read(memoryview(buf)[:nbytes])
+        self._protocol.buffer_updated(nbytes)
+
+    def read_events(self, timeout=None, max_events=None):
+        """Fetch available events, blocking until at least one is ready.
+
+        Returns up to ``max_events`` events, or an empty list if ``timeout``
+        (in seconds) expires first, or if the watcher is closed.
+        """
+        if self.closed:
+            return []
+        clock = self.clock
+        deadline = None if timeout is None else clock() + timeout
+        while not self._ready:
+            if self._next_refresh is not None and clock() >= self._next_refresh:
+                self._refresh_snapshots()
+                self._next_refresh = clock() + self.refresh_interval
+            if self.rescan_on_overflow:
+                self._run_snapshots()
+            if self._next_poll is not None and clock() >= self._next_poll:
+                self._poll_directories()
+            self._run_stages(clock())
+            if self._ready:
+                break
+
+            wakeups = [stage.deadline() for stage in self._stages] + [deadline, self._next_poll]
+            if self._stale:
+                wakeups.append(self._next_refresh)
+            wakeups = [wakeup for wakeup in wakeups if wakeup is not None]
+            self._read(max(0, min(wakeups) - clock()) if wakeups else None)
+            if deadline is not None and clock() >= deadline:
+                self._run_stages(clock())
+                break
+
+        return self._deliver(aioutils.pop_events(self._ready, max_events))
+
+    def __iter__(self):
+        """Iterate over events, until closed."""
+        while not self.closed:
+            yield from self.read_events()
+
+    def __enter__(self):
+        self.setup()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+"""Measure the time taken by ``import aionotify`` in a fresh interpreter.
+
+asyncio is imported by aionotify anyway; the time it takes is reported apart,
+as a baseline. With ``--max-ms``, exits with an error if aionotify's own share
+exceeds that budget, for use in CI.
+"""
+
+import argparse
+import statistics
+import subprocess
+import sys
+
+TIMER = "import time; start = time.perf_counter(); import %s; print(time.perf_counter() - start)"
+
+
+def measure(module, repeat):
+    """Time importing a module in ``repeat`` fresh interpreters; return the timings, in seconds."""
+    timings = []
+    for _i in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', TIMER % module])
+        timings.append(float(output))
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=20, help="Number of interpreters to start for each module")
+    parser.add_argument('--max-ms', type=float, help="Fail if aionotify adds more than that to the import of asyncio")
+    args = parser.parse_args()
+
+    baseline = statistics.median(measure('asyncio', args.repeat))
+    total = statistics.median(measure('aionotify', args.repeat))
+    own = total - baseline
+    print("import asyncio:   %.1f ms" % (baseline * 1e3))
+    print("import aionotify: %.1f ms (%.1f ms on top of asyncio)" % (total * 1e3, own * 1e3))
+    if args.max_ms is not None and own * 1e3 > args.max_ms:
+        sys.exit("aionotify's own import time, %.1f ms, exceeds %.1f ms" % (own * 1e3, args.max_ms))
+
+
+if __name__ == '__main__':
+    main()
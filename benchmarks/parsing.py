@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+"""Measure decoding of raw inotify buffers, without touching the kernel.
+
+Buffers are either synthesized, or replayed from a recording, e.g. made with
+``benchmarks/throughput.py --record``.
+"""
+
+import argparse
+import random
+import timeit
+
+import aionotify
+import aionotify.record
+from aionotify.base import PREFIX
+from aionotify.record import READ
+
+
+def record(wd, flags, name):
+    """Build an inotify record, with its name padded like the kernel does."""
+    raw = name.encode()
+    length = (len(raw) // 16 + 1) * 16 if raw else 0
+    return PREFIX.pack(wd, flags, 0, length) + raw.ljust(length, b'\x00')
+
+
+def synthesize(count, read_size, seed=0):
+    """Split records for ``count`` events into buffers of at most ``read_size`` bytes."""
+    rng = random.Random(seed)
+    flags = [aionotify.Flags.CREATE, aionotify.Flags.MODIFY, aionotify.Flags.CLOSE_WRITE, aionotify.Flags.DELETE]
+    buffers = []
+    current = b''
+    for i in range(count):
+        name = '%d-%s' % (i, 'x' * min(200, max(1, int(rng.lognormvariate(2.5, 0.8)))))
+        data = record(1, rng.choice(flags), name)
+        if len(current) + len(data) > read_size:
+            buffers.append(current)
+            current = b''
+        current += data
+    if current:
+        buffers.append(current)
+    return buffers
+
+
+def load(path):
+    """Load the raw reads of a recording."""
+    return [bytes(payload) for kind, _timestamp, payload in aionotify.record.read_recording(path) if kind == READ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--input', help="Replay buffers from a recording instead of synthesizing them")
+    parser.add_argument('--events', type=int, default=100000, help="Number of synthesized events")
+    parser.add_argument('--read-size', type=int, default=65536, help="Size of synthesized buffers")
+    parser.add_argument('--repeat', type=int, default=5, help="Number of timed runs; the best one is kept")
+    parser.add_argument('--names', action='store_true', help="Also decode each event's name")
+    args = parser.parse_args()
+
+    buffers = load(args.input) if args.input else synthesize(args.events, args.read_size)
+
+    watcher = aionotify.Watcher()
+    # Route any watch descriptor found in the buffers to an alias, as after watch().
+    wds = set()
+    for data in buffers:
+        offset = 0
+        while offset < len(data):
+            wd, _flags, _cookie, length = PREFIX.unpack_from(data, offset)
+            wds.add(wd)
+            offset += PREFIX.size + length
+    for wd in wds:
+        alias = 'watch-%d' % wd
+        watcher.aliases[wd] = alias
+        watcher.descriptors[alias] = wd
+
+    decode = watcher._decode
+
+    def run():
+        count = 0
+        for data in buffers:
+            events = decode(data)
+            if args.names:
+                for event in events:
+                    event.name
+            count += len(events)
+        return count
+
+    count = run()
+    best = min(timeit.repeat(run, number=1, repeat=args.repeat))
+    total = sum(len(data) for data in buffers)
+    print("Buffers:         %d (%d bytes, %d events)" % (len(buffers), total, count))
+    print("Decoding:        %.0f events/s, %.1f MiB/s" % (count / best, total / best / 2 ** 20))
+    print("Per event:       %.0f ns" % (best / max(1, count) * 1e9))
+
+
+if __name__ == '__main__':
+    main()
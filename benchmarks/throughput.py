@@ -0,0 +1,109 @@
+#!/usr/bin/env python
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+"""Measure event throughput and delivery latency under an event storm.
+
+A worker thread creates, modifies, renames and deletes files with names of
+varied lengths in a scratch directory (on tmpfs by default), while the
+watcher consumes the events; reports events/sec, p50/p99 delivery latency,
+read syscalls per event and peak RSS.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import resource
+import tempfile
+import threading
+import time
+
+import aionotify
+
+
+FLAGS = (
+    aionotify.Flags.CREATE | aionotify.Flags.MODIFY | aionotify.Flags.CLOSE_WRITE
+    | aionotify.Flags.MOVED_FROM | aionotify.Flags.MOVED_TO | aionotify.Flags.DELETE
+)
+
+
+def make_names(count, seed=0):
+    """File names with lengths spread between 1 and 200 characters."""
+    rng = random.Random(seed)
+    names = []
+    for i in range(count):
+        length = min(200, max(1, int(rng.lognormvariate(2.5, 0.8))))
+        prefix = '%d-' % i
+        names.append((prefix + 'x' * length)[:max(length, len(prefix))])
+    return names
+
+
+def storm(path, names, rounds):
+    """Generate events; each round creates, modifies, renames then deletes each file."""
+    for _round in range(rounds):
+        for name in names:
+            filename = os.path.join(path, name)
+            with open(filename, 'w') as f:
+                f.write('x')
+            with open(filename, 'a') as f:
+                f.write('y')
+            os.rename(filename, filename + '.1')
+            os.unlink(filename + '.1')
+
+
+async def run(args, path):
+    watcher = aionotify.Watcher(
+        stats=True, read_size=args.read_size, rename_window=args.rename_window, record_file=args.record,
+    )
+    watcher.watch(path, FLAGS)
+    await watcher.setup()
+
+    names = make_names(args.files)
+    thread = threading.Thread(target=storm, args=(path, names, args.rounds))
+    start = time.perf_counter()
+    thread.start()
+
+    received = 0
+    idle = 0
+    while idle < 3:
+        events = await watcher.get_events(timeout=0.2)
+        if events:
+            received += len(events)
+            idle = 0
+        elif not thread.is_alive():
+            idle += 1
+    elapsed = time.perf_counter() - start - 0.2 * idle
+    thread.join()
+    watcher.close()
+
+    stats = watcher.stats.snapshot()
+    latency = stats['latency']
+    print("Events:          %d (%d kernel records, %d overflows)" % (received, stats['events'], stats['overflows']))
+    print("Throughput:      %.0f events/s" % (stats['events'] / elapsed))
+    print("Latency:         p50 <= %.1f µs, p99 <= %.1f µs, max %.1f µs" % (
+        (latency['p50'] or 0) * 1e6, (latency['p99'] or 0) * 1e6, latency['max'] * 1e6,
+    ))
+    print("Reads:           %d (%.3f syscalls/event, %.0f bytes/read)" % (
+        stats['reads'], stats['reads'] / max(1, stats['events']), stats['bytes_per_read'] or 0,
+    ))
+    print("Peak RSS:        %.1f MiB" % (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dir', default='/dev/shm' if os.path.isdir('/dev/shm') else None,
+                        help="Where to create the scratch directory (default: /dev/shm)")
+    parser.add_argument('--files', type=int, default=1000, help="Number of distinct file names")
+    parser.add_argument('--rounds', type=int, default=5, help="Number of passes over all files")
+    parser.add_argument('--read-size', type=int, default=None, help="Size of the read buffer")
+    parser.add_argument('--rename-window', type=float, default=None, help="Pair renames within that window")
+    parser.add_argument('--record', help="Record the raw reads to that file, for benchmarks/parsing.py")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir, prefix='aionotify-bench-') as path:
+        asyncio.run(run(args, path))
+
+
+if __name__ == '__main__':
+    main()
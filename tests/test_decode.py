@@ -0,0 +1,82 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+import os
+import pickle
+import unittest
+
+import aionotify
+from aionotify import base
+
+
+def make_record(wd, flags, name=b'', cookie=0, length=None):
+    """Build a raw inotify record, NUL-padding the name as the kernel does."""
+    if length is None:
+        length = (len(name) // 16 + 1) * 16 if name else 0
+    return base.PREFIX.pack(wd, flags, cookie, length) + name.ljust(length, b'\x00')
+
+
+class DecodeTests(unittest.TestCase):
+    def setUp(self):
+        self.watcher = aionotify.Watcher()
+        self.watcher.aliases = {1: 'logs', 2: 'spool'}
+
+    def test_decode_buffer(self):
+        data = b''.join([
+            make_record(1, aionotify.Flags.CREATE, b'a.log'),
+            make_record(2, aionotify.Flags.MOVED_FROM, b'job', cookie=42),
+            make_record(1, aionotify.Flags.DELETE_SELF),
+        ])
+        events = self.watcher._decode(data)
+        self.assertEqual([
+            (aionotify.Flags.CREATE, 0, 'a.log', 'logs'),
+            (aionotify.Flags.MOVED_FROM, 42, 'job', 'spool'),
+            (aionotify.Flags.DELETE_SELF, 0, '', 'logs'),
+        ], events)
+
+    def test_decode_skips_removed_watches(self):
+        data = make_record(3, aionotify.Flags.CREATE, b'gone') + make_record(1, aionotify.Flags.CREATE, b'kept')
+        events = self.watcher._decode(bytearray(data))
+        self.assertEqual(['kept'], [event.name for event in events])
+
+
+class EventTests(unittest.TestCase):
+    def test_lazy_name(self):
+        event = aionotify.Event(aionotify.Flags.CREATE, 0, b'a.log\x00\x00\x00', 'logs')
+        self.assertIsNone(event._name)
+        self.assertEqual(b'a.log', event.raw_name)
+        self.assertEqual('a.log', event.name)
+
+    def test_undecodable_name(self):
+        event = aionotify.Event(aionotify.Flags.CREATE, 0, b'\xff.bin\x00', 'logs')
+        self.assertEqual(b'\xff.bin', event.raw_name)
+        self.assertEqual(os.fsdecode(b'\xff.bin'), event.name)
+
+    def test_tuple_compatibility(self):
+        event = aionotify.Event(aionotify.Flags.CREATE, 42, b'a\x00', 'logs')
+        flags, cookie, name, alias = event
+        self.assertEqual((aionotify.Flags.CREATE, 42, 'a', 'logs'), (flags, cookie, name, alias))
+        self.assertEqual((aionotify.Flags.CREATE, 42, 'a', 'logs'), event)
+        self.assertEqual(event, aionotify.Event(aionotify.Flags.CREATE, 42, 'a', 'logs'))
+        self.assertEqual(hash(event), hash((aionotify.Flags.CREATE, 42, 'a', 'logs')))
+        self.assertEqual('a', event[2])
+        self.assertEqual(4, len(event))
+        self.assertEqual({'flags': aionotify.Flags.CREATE, 'cookie': 42, 'name': 'a', 'alias': 'logs'}, event._asdict())
+        self.assertEqual(('b', 'logs'), event._replace(name='b')[2:])
+        self.assertEqual(event, pickle.loads(pickle.dumps(event)))
+
+    def test_predicates(self):
+        Flags = aionotify.Flags
+        event = aionotify.Event(Flags.CREATE | Flags.ISDIR, 0, 'a', 'logs')
+        self.assertEqual((True, False, False), (event.is_dir, event.is_move, event.is_overflow))
+        event = aionotify.Event(Flags.MOVED_FROM, 1, 'a', 'logs')
+        self.assertEqual((False, True, False), (event.is_dir, event.is_move, event.is_overflow))
+        event = aionotify.Event(Flags.Q_OVERFLOW, 0, b'', None)
+        self.assertEqual((False, False, True), (event.is_dir, event.is_move, event.is_overflow))
+        rename = aionotify.Rename('logs', 'a', 'logs', 'b', Flags.MOVED_FROM | Flags.MOVED_TO | Flags.ISDIR, 1)
+        self.assertEqual((True, True, False), (rename.is_dir, rename.is_move, rename.is_overflow))
+
+    def test_slots(self):
+        event = aionotify.Event(aionotify.Flags.CREATE, 0, 'a', 'logs')
+        with self.assertRaises(AttributeError):
+            event.extra = 1
@@ -0,0 +1,101 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+import asyncio
+import os
+
+import aionotify
+
+from .test_usage import AIONotifyTestCase
+
+
+class DispatcherTests(AIONotifyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.dispatcher = aionotify.Dispatcher(self.watcher)
+
+    def tearDown(self):
+        self.dispatcher.close()
+        super().tearDown()
+
+    async def _assert_empty(self, subscription):
+        await asyncio.sleep(0.1)
+        self.assertTrue(subscription.queue.empty())
+
+    async def test_shared_watch(self):
+        """Subscribers of the same path share a single kernel watch."""
+        creations = self.dispatcher.subscribe(self.testdir, aionotify.Flags.CREATE)
+        deletions = self.dispatcher.subscribe(self.testdir, aionotify.Flags.DELETE)
+        await self.dispatcher.setup(self.loop)
+        self.assertEqual(1, len(self.watcher.descriptors))
+        self.assertEqual(aionotify.Flags.CREATE | aionotify.Flags.DELETE, self.watcher.requests[self.testdir].flags)
+
+        self._touch('a')
+        self._unlink('a')
+
+        event = await creations.get_event()
+        self._assert_file_event(event, 'a', aionotify.Flags.CREATE)
+        event = await deletions.get_event()
+        self._assert_file_event(event, 'a', aionotify.Flags.DELETE)
+        await self._assert_empty(creations)
+        await self._assert_empty(deletions)
+
+    async def test_failed_subscribe(self):
+        """A subscription whose watch failed leaves nothing behind."""
+        await self.dispatcher.setup(self.loop)
+        missing = os.path.join(self.testdir, 'missing')
+        with self.assertRaises(FileNotFoundError):
+            self.dispatcher.subscribe(missing, aionotify.Flags.CREATE)
+        self.assertEqual({}, self.dispatcher.subscriptions)
+        self.assertNotIn(missing, self.watcher.requests)
+
+        os.mkdir(missing)
+        subscription = self.dispatcher.subscribe(missing, aionotify.Flags.CREATE)
+        self._touch(os.path.join('missing', 'a'))
+        event = await subscription.get_event()
+        self.assertEqual('a', event.name)
+
+    async def test_filter(self):
+        """Subscribers only get events passing their filter."""
+        await self.dispatcher.setup(self.loop)
+        logs = self.dispatcher.subscribe(
+            self.testdir, aionotify.Flags.CREATE, filter=lambda event: event.name.endswith('.log'),
+        )
+        everything = self.dispatcher.subscribe(self.testdir, aionotify.Flags.CREATE)
+
+        self._touch('a.txt')
+        self._touch('b.log')
+
+        event = await logs.get_event()
+        self._assert_file_event(event, 'b.log')
+        self.assertEqual(['a.txt', 'b.log'], [(await everything.get_event()).name for _i in range(2)])
+        await self._assert_empty(logs)
+
+    async def test_unsubscribe(self):
+        """Flags are narrowed, then the watch removed, as subscribers leave."""
+        creations = self.dispatcher.subscribe(self.testdir, aionotify.Flags.CREATE)
+        deletions = self.dispatcher.subscribe(self.testdir, aionotify.Flags.DELETE)
+        await self.dispatcher.setup(self.loop)
+
+        deletions.close()
+        self.assertEqual(aionotify.Flags.CREATE, self.watcher.requests[self.testdir].flags)
+        self._touch('a')
+        self._unlink('a')
+        event = await creations.get_event()
+        self._assert_file_event(event, 'a', aionotify.Flags.CREATE)
+        # The DELETE event is not even read from the kernel anymore.
+        await asyncio.sleep(0.1)
+        self.assertEqual(0, len(self.watcher._protocol.events))
+
+        creations.close()
+        self.assertEqual({}, self.watcher.descriptors)
+
+    async def test_close(self):
+        """Subscribers are notified when the dispatcher closes."""
+        subscription = self.dispatcher.subscribe(self.testdir, aionotify.Flags.CREATE)
+        await self.dispatcher.setup(self.loop)
+        self.dispatcher.close()
+
+        events = [event async for event in subscription]
+        self.assertEqual([], events)
@@ -14,3 +14,19 @@ class EnumsTests(unittest.TestCase):
 
         parsed = Flags.parse(flags)
         self.assertEqual([Flags.ACCESS, Flags.MODIFY, Flags.ATTRIB], parsed)
+
+    def test_parsing_all(self):
+        Flags = aionotify.Flags
+        self.assertEqual(list(Flags), Flags.parse(0xffffffff))
+        self.assertEqual([], Flags.parse(0))
+        self.assertEqual([Flags.CREATE, Flags.ISDIR], Flags.parse(0x40000100))
+
+    def test_split(self):
+        Flags = aionotify.Flags
+        mask = Flags.MOVED_FROM | Flags.ISDIR
+        self.assertEqual((Flags.MOVED_FROM, Flags.ISDIR), Flags.split(mask))
+        self.assertIs(Flags.split(mask), Flags.split(mask))
+        # parse() returns a new list each time.
+        parsed = Flags.parse(mask)
+        parsed.append(Flags.ACCESS)
+        self.assertEqual([Flags.MOVED_FROM, Flags.ISDIR], Flags.parse(mask))
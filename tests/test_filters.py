@@ -0,0 +1,37 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+import re
+import unittest
+
+from aionotify import filters
+
+
+class NameFilterTests(unittest.TestCase):
+    def test_include_glob(self):
+        name_filter = filters.NameFilter(include='*.ready')
+        self.assertTrue(name_filter(b'job.ready'))
+        self.assertFalse(name_filter(b'job.ready.tmp'))
+        self.assertFalse(name_filter(b'job'))
+
+    def test_glob_list(self):
+        name_filter = filters.NameFilter(include=['*.ready', '*.done'])
+        self.assertTrue(name_filter(b'job.ready'))
+        self.assertTrue(name_filter(b'job.done'))
+        self.assertFalse(name_filter(b'job.tmp'))
+
+    def test_exclude(self):
+        name_filter = filters.NameFilter(include='*.log', exclude=['.*'])
+        self.assertTrue(name_filter(b'app.log'))
+        self.assertFalse(name_filter(b'.app.log'))
+
+    def test_regex(self):
+        name_filter = filters.NameFilter(exclude=re.compile(r'~$|\.sw[po]$'))
+        self.assertTrue(name_filter(b'notes.txt'))
+        self.assertFalse(name_filter(b'notes.txt~'))
+        self.assertFalse(name_filter(b'.notes.txt.swp'))
+
+    def test_bytes_regex(self):
+        name_filter = filters.NameFilter(include=re.compile(rb'^\xff'))
+        self.assertTrue(name_filter(b'\xff.bin'))
+        self.assertFalse(name_filter(b'a.bin'))
@@ -0,0 +1,123 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+import asyncio
+import os
+import tempfile
+import unittest
+
+import aionotify
+from aionotify import record
+
+from .test_usage import AIONotifyTestCase, TESTDIR
+
+Flags = aionotify.Flags
+
+
+class RecorderTests(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory(dir=TESTDIR)
+        self.addCleanup(self._tmpdir.cleanup)
+        self.path = os.path.join(self._tmpdir.name, 'recording')
+
+    def test_roundtrip(self):
+        recorder = record.Recorder(self.path, chunk_size=64)
+        payloads = [bytes([i]) * (10 * i) for i in range(1, 20)]
+        for payload in payloads:
+            recorder.record_read(payload)
+        request = aionotify.base.WatchRequest('/var/log', Flags.CREATE, False, '*.log', None)
+        recorder.record_watch(3, ('logs', 1), request, None)
+        recorder.close()
+
+        entries = list(record.read_recording(self.path))
+        self.assertEqual([record.READ] * len(payloads) + [record.WATCH], [kind for kind, _ts, _payload in entries])
+        self.assertEqual(payloads, [bytes(payload) for _kind, _ts, payload in entries[:-1]])
+        self.assertEqual((3, ('logs', 1), tuple(request), None), record.decode_watch(entries[-1][2]))
+        timestamps = [timestamp for _kind, timestamp, _payload in entries]
+        self.assertEqual(sorted(timestamps), timestamps)
+        # The file is trimmed to its content.
+        size = len(record.MAGIC) + sum(record.ENTRY.size + len(payload) for _kind, _ts, payload in entries)
+        self.assertEqual(size, os.path.getsize(self.path))
+
+    def test_not_a_recording(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'garbage')
+        with self.assertRaises(ValueError):
+            list(record.read_recording(self.path))
+
+
+class ReplayTests(AIONotifyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._recdir = tempfile.TemporaryDirectory(dir=TESTDIR)
+        self.record_file = os.path.join(self._recdir.name, 'recording')
+
+    def tearDown(self):
+        super().tearDown()
+        self._recdir.cleanup()
+
+    async def _replay(self, **kwargs):
+        self.watcher = aionotify.ReplayWatcher(self.record_file, **kwargs)
+        await self.watcher.setup(self.loop)
+        return [event async for event in self.watcher]
+
+    async def test_replay(self):
+        """Replayed events match the recorded ones."""
+        self.watcher = aionotify.Watcher(record_file=self.record_file)
+        self.watcher.watch(self.testdir, Flags.CREATE | Flags.DELETE, alias='dir')
+        await self.watcher.setup(self.loop)
+        self._touch('a')
+        self._unlink('a')
+        recorded = [await self.watcher.get_event() for _i in range(2)]
+        self.watcher.close()
+
+        replayed = await self._replay(speed=None)
+        self.assertEqual(recorded, replayed)
+        self.assertEqual([('a', Flags.CREATE), ('a', Flags.DELETE)], [(e.name, e.flags) for e in replayed])
+        self.assertEqual('dir', replayed[0].alias)
+
+    async def test_replay_recursive(self):
+        """Subdirectories of recursive watches are replayed, with their names and filters."""
+        self.watcher = aionotify.Watcher(record_file=self.record_file)
+        self.watcher.watch(self.testdir, Flags.CREATE, recursive=True, exclude='*.tmp')
+        await self.watcher.setup(self.loop)
+        os.mkdir(os.path.join(self.testdir, 'sub'))
+        # Let the subdirectory get watched: entries found while listing it are not replayed.
+        await self.watcher.get_event()
+        self._touch(os.path.join('sub', 'a'))
+        self._touch(os.path.join('sub', 'b.tmp'))
+        await self.watcher.get_event()
+        self.watcher.close()
+
+        replayed = await self._replay(speed=None)
+        self.assertEqual(['sub', 'sub/a'], [event.name for event in replayed])
+        self.assertEqual(1, self.watcher.filtered[self.testdir])
+
+    async def test_pace(self):
+        """By default, the recorded pace is kept."""
+        recorder = record.Recorder(self.record_file)
+        recorder.record_watch(1, 'dir', aionotify.base.WatchRequest(self.testdir, Flags.CREATE), None)
+        recorder.record_read(aionotify.base.PREFIX.pack(1, Flags.CREATE, 0, 0))
+        recorder._start -= 0.2
+        recorder.record_read(aionotify.base.PREFIX.pack(1, Flags.CREATE, 0, 0))
+        recorder.close()
+
+        start = self.loop.time()
+        self.assertEqual(2, len(await self._replay(speed=2)))
+        self.assertGreaterEqual(self.loop.time() - start, 0.1)
+
+    def test_no_watch(self):
+        with self.assertRaises(TypeError):
+            aionotify.ReplayWatcher(self.record_file).watch(self.testdir, Flags.CREATE)
+
+    async def test_sync_recording(self):
+        with aionotify.SyncWatcher(record_file=self.record_file) as watcher:
+            watcher.watch(self.testdir, Flags.CREATE)
+            self._touch('a')
+            self.assertEqual(1, len(watcher.read_events(timeout=1)))
+
+        replayed = await self._replay(speed=None)
+        self._assert_file_event(replayed[0], 'a')
+        await asyncio.sleep(0)
@@ -0,0 +1,133 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+import asyncio
+import unittest
+
+import aionotify
+from aionotify.routing import Router
+
+from .test_usage import AIONotifyTestCase
+
+
+class RouterTests(unittest.TestCase):
+
+    def setUp(self):
+        self.router = Router()
+        self.calls = []
+
+    def handler(self, name):
+        return lambda event: self.calls.append((name, event))
+
+    def test_exact_and_prefix(self):
+        """Handlers get events of their alias, and of aliases below it."""
+        root = self.handler('root')
+        logs = self.handler('logs')
+        self.router.add('/srv', aionotify.Flags.CREATE, root)
+        self.router.add('/srv/logs', aionotify.Flags.CREATE, logs)
+
+        self.assertEqual([root], self.router.route(aionotify.Event(aionotify.Flags.CREATE, 0, 'a', '/srv')))
+        self.assertEqual([root, logs], self.router.route(aionotify.Event(aionotify.Flags.CREATE, 0, 'a', '/srv/logs')))
+        self.assertEqual([], self.router.route(aionotify.Event(aionotify.Flags.CREATE, 0, 'a', '/srv2')))
+
+    def test_flags(self):
+        """Handlers only get events matching their mask, or sent by the kernel unrequested."""
+        handler = self.handler('h')
+        self.router.add('a', aionotify.Flags.CREATE, handler)
+        self.assertEqual([], self.router.route(aionotify.Event(aionotify.Flags.DELETE, 0, 'x', 'a')))
+        self.assertEqual([handler], self.router.route(aionotify.Event(aionotify.Flags.IGNORED, 0, '', 'a')))
+        self.assertEqual([handler], self.router.route(aionotify.Event(aionotify.Flags.Q_OVERFLOW, 0, '', None)))
+
+    def test_tuple_alias(self):
+        """Non-string aliases are matched exactly."""
+        handler = self.handler('h')
+        catch_all = self.handler('all')
+        self.router.add(('srv', 1), aionotify.Flags.CREATE, handler)
+        self.router.add('', aionotify.Flags.CREATE, catch_all)
+        self.assertEqual(
+            [handler, catch_all], self.router.route(aionotify.Event(aionotify.Flags.CREATE, 0, 'a', ('srv', 1))),
+        )
+        self.assertEqual([catch_all], self.router.route(aionotify.Event(aionotify.Flags.CREATE, 0, 'a', ('srv', 2))))
+
+    def test_remove(self):
+        handler = self.handler('h')
+        self.router.add('', aionotify.Flags.CREATE, handler)
+        event = aionotify.Event(aionotify.Flags.CREATE, 0, 'x', 'a')
+        self.assertEqual([handler], self.router.route(event))
+
+        self.router.remove('', handler)
+        self.assertEqual([], self.router.route(event))
+        with self.assertRaises(ValueError):
+            self.router.remove('', handler)
+
+
+class ServeTests(AIONotifyTestCase):
+
+    async def test_handlers(self):
+        """serve() runs plain and coroutine handlers, within the concurrency limit."""
+        calls = []
+        running = []
+        peak = []
+
+        async def slow(event):
+            running.append(event)
+            peak.append(len(running))
+            await asyncio.sleep(0.05)
+            running.remove(event)
+            calls.append(('slow', event.name))
+
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        self.watcher.on(self.testdir, aionotify.Flags.CREATE, lambda event: calls.append(('plain', event.name)))
+        self.watcher.on('', aionotify.Flags.CREATE, slow)
+        self.watcher.on(self.testdir, aionotify.Flags.DELETE, lambda event: calls.append(('delete', event.name)))
+        await self.watcher.setup(self.loop)
+        task = asyncio.ensure_future(self.watcher.serve(max_concurrency=2))
+
+        for name in 'abcd':
+            self._touch(name)
+        while len(calls) < 8:
+            await asyncio.sleep(0.01)
+
+        self.assertEqual(['a', 'b', 'c', 'd'], [name for kind, name in calls if kind == 'plain'])
+        self.assertEqual(['a', 'b', 'c', 'd'], sorted(name for kind, name in calls if kind == 'slow'))
+        self.assertLessEqual(max(peak), 2)
+
+        self.watcher.close()
+        await asyncio.wait_for(task, 1)
+
+    async def test_unwatch(self):
+        """Removed watches don't keep their resolved handlers."""
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        self.watcher.on('', aionotify.Flags.CREATE, lambda event: None)
+        await self.watcher.setup(self.loop)
+        task = asyncio.ensure_future(self.watcher.serve())
+        self._touch('a')
+        while self.testdir not in self.watcher._router._routes:
+            await asyncio.sleep(0.01)
+
+        self.watcher.unwatch(self.testdir)
+        self.assertEqual({}, self.watcher._router._routes)
+        self.watcher.close()
+        await asyncio.wait_for(task, 1)
+
+    async def test_failing_handler(self):
+        """Handler exceptions are logged, and don't stop serving."""
+        calls = []
+
+        def failing(event):
+            raise RuntimeError("Boom")
+
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        self.watcher.on(self.testdir, aionotify.Flags.CREATE, failing)
+        self.watcher.on(self.testdir, aionotify.Flags.CREATE, lambda event: calls.append(event.name))
+        await self.watcher.setup(self.loop)
+        task = asyncio.ensure_future(self.watcher.serve())
+
+        with self.assertLogs('aionotify', 'ERROR'):
+            self._touch('a')
+            while not calls:
+                await asyncio.sleep(0.01)
+        self.assertEqual(['a'], calls)
+
+        self.watcher.close()
+        await asyncio.wait_for(task, 1)
@@ -0,0 +1,145 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+import asyncio
+import os
+
+import aionotify
+
+from .test_usage import AIONotifyTestCase
+
+
+class ShardedWatcherTests(AIONotifyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.sharded = aionotify.ShardedWatcher(shards=2)
+        self.subdirs = []
+        for name in 'abcd':
+            path = os.path.join(self.testdir, name)
+            os.mkdir(path)
+            self.subdirs.append(path)
+
+    def tearDown(self):
+        self.sharded.close()
+        super().tearDown()
+
+    async def _collect(self, count):
+        events = []
+        while len(events) < count:
+            events.extend(await self.sharded.get_events())
+        return events
+
+    async def test_merged_events(self):
+        """Events from all shards reach the caller, in order for each alias."""
+        for path in self.subdirs:
+            self.sharded.watch(path, aionotify.Flags.CREATE)
+        await self.sharded.setup(self.loop)
+        self.assertEqual(set(self.subdirs), set(self.sharded.requests))
+
+        for path in self.subdirs:
+            for name in ('1', '2', '3'):
+                self._touch(name, parent=path)
+
+        events = await self._collect(12)
+        for path in self.subdirs:
+            self.assertEqual(['1', '2', '3'], [event.name for event in events if event.alias == path])
+
+    async def test_watch_after_start(self):
+        """Watches can be added and removed once shards run."""
+        await self.sharded.setup(self.loop)
+        self.sharded.watch(self.subdirs[0], aionotify.Flags.CREATE, alias='first')
+        self.assertIn('first', self.sharded.shard_for('first').requests)
+
+        self._touch('x', parent=self.subdirs[0])
+        event = await self.sharded.get_event()
+        self._assert_file_event(event, 'x', alias='first')
+
+        self.sharded.unwatch('first')
+        self.assertEqual({}, self.sharded.requests)
+        self._touch('y', parent=self.subdirs[0])
+        self.assertEqual([], await self.sharded.get_events(timeout=0.1))
+
+    async def test_watch_many(self):
+        """Watches can be added and removed in bulk from the event loop."""
+        await self.sharded.setup(self.loop)
+        missing = os.path.join(self.testdir, 'missing')
+        watches = [(path, aionotify.Flags.CREATE, None) for path in self.subdirs]
+        errors = await self.sharded.watch_many(watches + [(missing, aionotify.Flags.CREATE, 'missing')])
+        self.assertEqual(['missing'], list(errors))
+        self.assertEqual(set(self.subdirs), set(self.sharded.requests))
+
+        self._touch('x', parent=self.subdirs[0])
+        event = await self.sharded.get_event()
+        self._assert_file_event(event, 'x', alias=self.subdirs[0])
+
+        errors = await self.sharded.unwatch_many(self.subdirs + ['missing'])
+        self.assertEqual(['missing'], list(errors))
+        self.assertEqual({}, self.sharded.requests)
+
+    async def test_failed_setup(self):
+        """Shards which did start are stopped if another one fails."""
+        self.sharded.watch(os.path.join(self.testdir, 'missing'), aionotify.Flags.CREATE)
+        with self.assertRaises(FileNotFoundError):
+            await self.sharded.setup(self.loop)
+        for thread in self.sharded._threads:
+            thread.join(1)
+            self.assertFalse(thread.is_alive())
+
+    async def test_backpressure(self):
+        """Once the merged queue is full, events pile up in the shard's queue."""
+        self.sharded = aionotify.ShardedWatcher(shards=1, max_queue=5, queue_policy='drop-oldest')
+        self.sharded.watch(self.subdirs[0], aionotify.Flags.CREATE)
+        await self.sharded.setup(self.loop)
+        names = ['file%02d' % i for i in range(10)]
+
+        # Fills the merged queue.
+        self._touch('x', parent=self.subdirs[0])
+        await asyncio.sleep(0.1)
+        # Held by the shard, waiting for room in the merged queue.
+        self._touch('y', parent=self.subdirs[0])
+        await asyncio.sleep(0.1)
+        # Left in the shard's queue, read one at a time.
+        for name in names:
+            self._touch(name, parent=self.subdirs[0])
+            await asyncio.sleep(0.01)
+
+        events = await self._collect(7)
+        self.assertEqual(['x', 'y'] + names[-5:], [event.name for event in events])
+        self.assertEqual([], await self.sharded.get_events(timeout=0.1))
+
+    async def test_state_file(self):
+        """Saved watches are restored once, each by its shard."""
+        state_file = os.path.join(self.testdir, 'state')
+        self.sharded = aionotify.ShardedWatcher(shards=3, state_file=state_file)
+        for path in self.subdirs:
+            self.sharded.watch(path, aionotify.Flags.CREATE)
+        await self.sharded.setup(self.loop)
+        await self.sharded.save_state()
+        self.sharded.close()
+
+        self._touch('x', parent=self.subdirs[0])
+        self.sharded = aionotify.ShardedWatcher(shards=3, state_file=state_file)
+        await self.sharded.setup(self.loop)
+        self.assertEqual(set(self.subdirs), set(self.sharded.requests))
+        self.assertEqual(4, sum(len(shard.descriptors) for shard in self.sharded.shards))
+        events = await self._collect(1)
+        self.assertEqual([('x', self.subdirs[0])], [(event.name, event.alias) for event in events])
+
+        self._touch('y', parent=self.subdirs[1])
+        events = await self._collect(1)
+        self.assertEqual([('y', self.subdirs[1])], [(event.name, event.alias) for event in events])
+        self.assertEqual([], await self.sharded.get_events(timeout=0.1))
+
+    def test_record_file(self):
+        with self.assertRaises(ValueError):
+            aionotify.ShardedWatcher(shards=2, record_file=os.path.join(self.testdir, 'recording'))
+
+    async def test_close(self):
+        """All readers are woken up on close."""
+        await self.sharded.setup(self.loop)
+        readers = [asyncio.ensure_future(self.sharded.get_event()) for _i in range(2)]
+        await asyncio.sleep(0)
+        self.sharded.close()
+        self.assertEqual([None, None], await asyncio.gather(*readers))
+        self.assertEqual([], [event async for event in self.sharded])
@@ -0,0 +1,60 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+import os
+import tempfile
+import unittest
+
+from aionotify import snapshot
+from aionotify.enums import Flags
+
+
+class ScanTests(unittest.TestCase):
+    def test_scan(self):
+        with tempfile.TemporaryDirectory() as path:
+            os.mkdir(os.path.join(path, 'sub'))
+            with open(os.path.join(path, 'a'), 'w') as f:
+                f.write('abc')
+
+            entries = snapshot.scan(path)
+            self.assertEqual({'a', 'sub'}, set(entries))
+            inode, _mtime, size, is_dir = entries['a']
+            self.assertEqual(os.stat(os.path.join(path, 'a')).st_ino, inode)
+            self.assertEqual((3, False), (size, is_dir))
+            self.assertTrue(entries['sub'][3])
+
+    def test_scan_all_skips_errors(self):
+        with tempfile.TemporaryDirectory() as path:
+            snapshots = snapshot.scan_all({1: path, 2: os.path.join(path, 'nonexistent')})
+        self.assertEqual({1: {}}, snapshots)
+
+
+class DiffTests(unittest.TestCase):
+    def test_diff(self):
+        old = {
+            'kept': (1, 10, 3, False),
+            'modified': (2, 10, 3, False),
+            'replaced': (3, 10, 3, False),
+            'deleted': (4, 10, 3, False),
+            'dir': (5, 10, 4096, True),
+        }
+        new = {
+            'kept': (1, 10, 3, False),
+            'modified': (2, 20, 5, False),
+            'replaced': (6, 10, 3, False),
+            'created': (7, 10, 3, False),
+            'dir': (5, 20, 4096, True),
+        }
+        self.assertEqual([
+            ('modified', Flags.MODIFY),
+            ('replaced', Flags.DELETE),
+            ('replaced', Flags.CREATE),
+            ('created', Flags.CREATE),
+            ('deleted', Flags.DELETE),
+        ], snapshot.diff(old, new))
+
+    def test_directories(self):
+        self.assertEqual(
+            [('new', Flags.CREATE | Flags.ISDIR), ('old', Flags.DELETE | Flags.ISDIR)],
+            snapshot.diff({'old': (1, 10, 0, True)}, {'new': (2, 10, 0, True)}),
+        )
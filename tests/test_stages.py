@@ -0,0 +1,153 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+import concurrent.futures
+import math
+import os
+import tempfile
+import time
+import unittest
+
+from aionotify import stages
+from aionotify.enums import Flags
+from aionotify.events import Event, Rename
+
+from .test_usage import TESTDIR
+
+
+class CoalescerTests(unittest.TestCase):
+    def test_merge_within_window(self):
+        coalescer = stages.Coalescer(window=1)
+        self.assertEqual([], coalescer.feed([
+            Event(Flags.MODIFY, 0, 'a', 'logs'),
+            Event(Flags.MODIFY, 0, 'b', 'logs'),
+            Event(Flags.CLOSE_WRITE, 0, 'a', 'logs'),
+        ], now=10))
+        self.assertEqual(11, coalescer.deadline())
+
+        self.assertEqual([], coalescer.feed([Event(Flags.ATTRIB, 0, 'a', 'logs')], now=10.5))
+        self.assertEqual([
+            (Flags.MODIFY | Flags.CLOSE_WRITE | Flags.ATTRIB, 0, 'a', 'logs'),
+            (Flags.MODIFY, 0, 'b', 'logs'),
+        ], coalescer.feed([], now=11))
+        self.assertIsNone(coalescer.deadline())
+
+    def test_separate_aliases(self):
+        coalescer = stages.Coalescer(window=1)
+        events = [Event(Flags.MODIFY, 0, 'a', 'logs'), Event(Flags.MODIFY, 0, 'a', 'spool')]
+        self.assertEqual(events, coalescer.feed(events, now=math.inf))
+
+    def test_discard(self):
+        coalescer = stages.Coalescer(window=1)
+        coalescer.feed([Event(Flags.MODIFY, 0, 'a', 'logs'), Event(Flags.MODIFY, 0, 'a', 'spool')], now=0)
+        coalescer.discard(lambda event: event.alias == 'logs')
+        self.assertEqual(['spool'], [event.alias for event in coalescer.feed([], now=1)])
+
+
+class RenamePairerTests(unittest.TestCase):
+    def test_pair_in_batch(self):
+        pairer = stages.RenamePairer(timeout=1)
+        self.assertEqual([
+            Rename('logs', 'a', 'spool', 'b', Flags.MOVED_FROM | Flags.MOVED_TO, 42),
+            Event(Flags.CREATE, 0, 'c', 'logs'),
+        ], pairer.feed([
+            Event(Flags.MOVED_FROM, 42, 'a', 'logs'),
+            Event(Flags.CREATE, 0, 'c', 'logs'),
+            Event(Flags.MOVED_TO, 42, 'b', 'spool'),
+        ], now=0))
+        self.assertIsNone(pairer.deadline())
+
+    def test_pair_across_batches(self):
+        pairer = stages.RenamePairer(timeout=1)
+        self.assertEqual([], pairer.feed([Event(Flags.MOVED_FROM, 42, 'a', 'logs')], now=0))
+        self.assertEqual(1, pairer.deadline())
+        events = pairer.feed([Event(Flags.MOVED_TO, 42, 'b', 'logs')], now=0.5)
+        self.assertEqual([('logs', 'a', 'logs', 'b')], [event[:4] for event in events])
+
+    def test_unmatched(self):
+        pairer = stages.RenamePairer(timeout=1)
+        moved_from = Event(Flags.MOVED_FROM, 42, 'a', 'logs')
+        moved_to = Event(Flags.MOVED_TO, 43, 'b', 'logs')
+        created = Event(Flags.CREATE, 0, 'c', 'logs')
+        self.assertEqual([], pairer.feed([moved_from, created], now=0))
+        self.assertEqual([moved_from, created, moved_to], pairer.feed([moved_to], now=1))
+        self.assertIsNone(pairer.deadline())
+
+    def test_renames_not_coalesced(self):
+        coalescer = stages.Coalescer(window=1)
+        rename = Rename('logs', 'a', 'logs', 'b', Flags.MOVED_FROM | Flags.MOVED_TO, 42)
+        modify = Event(Flags.MODIFY, 0, 'b', 'logs')
+        self.assertEqual([rename, modify], coalescer.feed([rename, modify], now=math.inf))
+
+
+class ContentVerifierTests(unittest.TestCase):
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory(dir=TESTDIR)
+        self.addCleanup(self._tmpdir.cleanup)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.addCleanup(self.executor.shutdown)
+        self.verifier = stages.ContentVerifier(
+            lambda event: os.path.join(self._tmpdir.name, event.name), executor=self.executor,
+        )
+        self.mtime = 10 ** 18
+
+    def _write(self, name, content):
+        path = os.path.join(self._tmpdir.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        # Make sure each write gets a distinct mtime.
+        self.mtime += 10 ** 9
+        os.utime(path, ns=(self.mtime, self.mtime))
+
+    def _feed(self, *events, now=math.inf):
+        return [(event.name, event.flags) for event in self.verifier.feed(list(events), now=now)]
+
+    def test_unchanged(self):
+        self._write('a', 'hello')
+        self.assertEqual([('a', Flags.CLOSE_WRITE)], self._feed(Event(Flags.CLOSE_WRITE, 0, 'a', 'dir')))
+        # Closed again without writing.
+        self.assertEqual([], self._feed(Event(Flags.CLOSE_WRITE, 0, 'a', 'dir')))
+        self.assertEqual(1, self.verifier.unchanged)
+
+    def test_rewritten(self):
+        """Rewriting a file with the same content is detected through hashes."""
+        self._write('a', 'hello')
+        self._feed(Event(Flags.CLOSE_WRITE, 0, 'a', 'dir'))
+        self._write('a', 'hello')
+        # The first digest has nothing to compare against.
+        self.assertEqual([('a', Flags.CLOSE_WRITE)], self._feed(Event(Flags.CLOSE_WRITE, 0, 'a', 'dir')))
+        self._write('a', 'hello')
+        self.assertEqual([], self._feed(Event(Flags.CLOSE_WRITE, 0, 'a', 'dir')))
+        self._write('a', 'HELLO')
+        self.assertEqual([('a', Flags.CLOSE_WRITE)], self._feed(Event(Flags.CLOSE_WRITE, 0, 'a', 'dir')))
+        self._write('a', 'hello!')
+        self.assertEqual([('a', Flags.CLOSE_WRITE)], self._feed(Event(Flags.CLOSE_WRITE, 0, 'a', 'dir')))
+
+    def test_ordering(self):
+        """Events wait for pending hashes."""
+        for _i in range(2):
+            self._write('a', 'hello')
+            self._feed(Event(Flags.CLOSE_WRITE, 0, 'a', 'dir'))
+        self._write('a', 'hello')
+        self.executor.submit(time.sleep, 0.05)
+        self.assertEqual([], self._feed(
+            Event(Flags.CLOSE_WRITE, 0, 'a', 'dir'), Event(Flags.CREATE, 0, 'b', 'dir'), now=0,
+        ))
+        self.assertEqual(0.01, self.verifier.deadline())
+        self.assertEqual([('b', Flags.CREATE)], self._feed())
+
+    def test_other_events(self):
+        self._write('a', 'hello')
+        self._feed(Event(Flags.CLOSE_WRITE, 0, 'a', 'dir'))
+        events = [Event(Flags.MODIFY, 0, 'a', 'dir'), Event(Flags.DELETE, 0, 'a', 'dir')]
+        self.assertEqual([('a', Flags.MODIFY), ('a', Flags.DELETE)], self._feed(*events))
+        # Deleted files are forgotten.
+        self._write('a', 'hello')
+        self.assertEqual([('a', Flags.CLOSE_WRITE)], self._feed(Event(Flags.CLOSE_WRITE, 0, 'a', 'dir')))
+
+    def test_cache_size(self):
+        self.verifier.cache_size = 1
+        self._write('a', 'a')
+        self._write('b', 'b')
+        self._feed(Event(Flags.CLOSE_WRITE, 0, 'a', 'dir'), Event(Flags.CLOSE_WRITE, 0, 'b', 'dir'))
+        self.assertEqual([os.path.join(self._tmpdir.name, 'b')], list(self.verifier._cache))
@@ -0,0 +1,218 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+import json
+import os
+import re
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+import zlib
+
+import aionotify
+from aionotify import state
+
+from .test_usage import AIONotifyTestCase, TESTDIR
+
+Flags = aionotify.Flags
+
+
+class StateFileTests(unittest.TestCase):
+
+    def setUp(self):
+        self._tmpdir = tempfile.TemporaryDirectory(dir=TESTDIR)
+        self.path = os.path.join(self._tmpdir.name, 'state')
+
+    def tearDown(self):
+        self._tmpdir.cleanup()
+
+    def test_roundtrip(self):
+        request = aionotify.base.WatchRequest('/tmp', Flags.CREATE, True, '*.log', None)
+        fingerprints = {('tmp', ''): {'a': (1, 2, 3, False)}, ('tmp', 'sub'): {}}
+        state.dump(self.path, {'tmp': request}, fingerprints)
+        self.assertEqual(({'tmp': tuple(request)}, fingerprints), state.load(self.path))
+        self.assertEqual(['state'], os.listdir(self._tmpdir.name))
+
+    def test_patterns(self):
+        """Compiled patterns are saved as their pattern and flags."""
+        exclude = re.compile(b'^\\.', re.I)
+        request = aionotify.base.WatchRequest('/tmp', Flags.CREATE, False, ['*.log', '*.txt'], exclude)
+        state.dump(self.path, {('tmp', 1): request}, {(('tmp', 1), ''): {}})
+        self.assertEqual(({('tmp', 1): tuple(request)}, {(('tmp', 1), ''): {}}), state.load(self.path))
+        with open(self.path, 'rb') as f:
+            data = json.loads(zlib.decompress(f.read()))
+        self.assertEqual({'pattern': '^\\.', 'flags': re.I, 'bytes': True}, data['requests'][0][5])
+
+    def test_invalid(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'garbage')
+        with self.assertRaises(ValueError):
+            state.load(self.path)
+
+
+class RestoreTests(AIONotifyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self._statedir = tempfile.TemporaryDirectory(dir=TESTDIR)
+        self.state_file = os.path.join(self._statedir.name, 'state')
+
+    def tearDown(self):
+        super().tearDown()
+        self._statedir.cleanup()
+
+    async def _restart(self):
+        """Save the state, close the watcher and start a new one from that state."""
+        await self.watcher.save_state()
+        self.watcher.close()
+        self.watcher = aionotify.Watcher(state_file=self.state_file)
+
+    async def _collect(self):
+        events = []
+        while True:
+            batch = await self.watcher.get_events(timeout=0.1)
+            if not batch:
+                return sorted((event.name, event.flags) for event in events)
+            events.extend(batch)
+
+    async def test_no_state(self):
+        """A missing state file is not an error."""
+        self.watcher = aionotify.Watcher(state_file=self.state_file)
+        self.watcher.watch(self.testdir, Flags.CREATE)
+        await self.watcher.setup(self.loop)
+        self.assertEqual([], await self._collect())
+
+    async def test_delta(self):
+        """Only the changes since the state was saved are reported."""
+        self._touch('a')
+        self._touch('b')
+        self.watcher = aionotify.Watcher(state_file=self.state_file)
+        self.watcher.watch(self.testdir, Flags.CREATE | Flags.DELETE | Flags.MODIFY, alias='dir')
+        await self.watcher.setup(self.loop)
+        await self._restart()
+
+        self._unlink('a')
+        with open(os.path.join(self.testdir, 'b'), 'w') as f:
+            f.write('changed')
+        self._touch('c')
+
+        await self.watcher.setup(self.loop)
+        self.assertEqual(['dir'], list(self.watcher.requests))
+        self.assertEqual([('a', Flags.DELETE), ('b', Flags.MODIFY), ('c', Flags.CREATE)], await self._collect())
+
+        # Live events flow as usual.
+        self._touch('d')
+        event = await self.watcher.get_event()
+        self._assert_file_event(event, 'd', alias='dir')
+
+    async def test_requested_flags(self):
+        """Changes are only reported for the watch's flags."""
+        self.watcher = aionotify.Watcher(state_file=self.state_file)
+        self.watcher.watch(self.testdir, Flags.DELETE)
+        await self.watcher.setup(self.loop)
+        self._touch('a')
+        await self._restart()
+
+        self._unlink('a')
+        self._touch('b')
+        await self.watcher.setup(self.loop)
+        self.assertEqual([('a', Flags.DELETE)], await self._collect())
+
+    async def test_recursive(self):
+        self.watcher = aionotify.Watcher(state_file=self.state_file)
+        self.watcher.watch(self.testdir, Flags.CREATE, recursive=True)
+        await self.watcher.setup(self.loop)
+        await self._restart()
+
+        os.makedirs(os.path.join(self.testdir, 'sub', 'inner'))
+        self._touch(os.path.join('sub', 'x'))
+
+        await self.watcher.setup(self.loop)
+        self.assertEqual([
+            ('sub', Flags.CREATE | Flags.ISDIR),
+            ('sub/inner', Flags.CREATE | Flags.ISDIR),
+            ('sub/x', Flags.CREATE),
+        ], await self._collect())
+
+    async def test_recursive_removed_subdir(self):
+        """The content of a subdirectory removed while stopped is reported, as for a removed watch."""
+        os.makedirs(os.path.join(self.testdir, 'sub', 'inner'))
+        self._touch(os.path.join('sub', 'x'))
+        self._touch(os.path.join('sub', 'inner', 'y'))
+        self.watcher = aionotify.Watcher(state_file=self.state_file)
+        self.watcher.watch(self.testdir, Flags.DELETE, recursive=True)
+        await self.watcher.setup(self.loop)
+        await self._restart()
+
+        shutil.rmtree(os.path.join(self.testdir, 'sub'))
+        await self.watcher.setup(self.loop)
+        self.assertEqual([
+            ('sub', Flags.DELETE | Flags.ISDIR),
+            ('sub/inner', Flags.DELETE | Flags.ISDIR),
+            ('sub/inner/y', Flags.DELETE),
+            ('sub/x', Flags.DELETE),
+        ], await self._collect())
+
+    async def test_unchanged_subdirs(self):
+        """Catching up does not list again the subdirectories unchanged since the state was saved."""
+        os.makedirs(os.path.join(self.testdir, 'sub', 'inner'))
+        self.watcher = aionotify.Watcher(state_file=self.state_file)
+        self.watcher.watch(self.testdir, Flags.CREATE, recursive=True)
+        await self.watcher.setup(self.loop)
+        await self._restart()
+
+        self._touch('a')
+        with mock.patch('os.scandir', wraps=os.scandir) as scandir:
+            await self.watcher.setup(self.loop)
+        self.assertEqual([('a', Flags.CREATE)], await self._collect())
+        listed = [os.path.relpath(call.args[0], self.testdir) for call in scandir.call_args_list]
+        # The root was changed; each directory is read once by the rescan.
+        self.assertEqual(['.', '.', 'sub', 'sub/inner'], sorted(listed))
+
+        # Subdirectories are still watched.
+        self._touch(os.path.join('sub', 'inner', 'b'))
+        self.assertEqual([('sub/inner/b', Flags.CREATE)], await self._collect())
+
+    async def test_removed_path(self):
+        """A saved path removed while stopped is reported, and no longer watched."""
+        subdir = os.path.join(self.testdir, 'gone')
+        os.mkdir(subdir)
+        self._touch(os.path.join('gone', 'a'))
+        self.watcher = aionotify.Watcher(state_file=self.state_file)
+        self.watcher.watch(self.testdir, Flags.CREATE, alias='dir')
+        self.watcher.watch(subdir, Flags.DELETE | Flags.DELETE_SELF, alias='gone')
+        await self.watcher.setup(self.loop)
+        await self._restart()
+
+        self._unlink(os.path.join('gone', 'a'))
+        os.rmdir(subdir)
+        await self.watcher.setup(self.loop)
+        self.assertEqual(['dir'], list(self.watcher.requests))
+        self.assertEqual([('', Flags.DELETE_SELF), ('a', Flags.DELETE)], await self._collect())
+
+        # Restarts keep working.
+        await self._restart()
+        await self.watcher.setup(self.loop)
+        self.assertEqual([], await self._collect())
+
+    async def test_failed_setup(self):
+        """The inotify fd is closed when setup() fails."""
+        fds = len(os.listdir('/proc/self/fd'))
+        self.watcher = aionotify.Watcher()
+        self.watcher.watch(os.path.join(self.testdir, 'missing'), Flags.CREATE)
+        with self.assertRaises(FileNotFoundError):
+            await self.watcher.setup(self.loop)
+        self.assertEqual(fds, len(os.listdir('/proc/self/fd')))
+        self.assertTrue(self.watcher.closed)
+
+    async def test_sync(self):
+        """SyncWatcher shares the same state files."""
+        self._touch('a')
+        with aionotify.SyncWatcher(state_file=self.state_file) as watcher:
+            watcher.watch(self.testdir, Flags.CREATE | Flags.DELETE)
+            watcher.save_state()
+
+        self._unlink('a')
+        with aionotify.SyncWatcher(state_file=self.state_file) as watcher:
+            self.assertEqual([('a', Flags.DELETE)], [(e.name, e.flags) for e in watcher.read_events(timeout=0.1)])
@@ -0,0 +1,73 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+import unittest
+
+import aionotify
+from aionotify import stats
+
+from .test_usage import AIONotifyTestCase
+
+
+class HistogramTests(unittest.TestCase):
+
+    def test_empty(self):
+        histogram = stats.Histogram()
+        self.assertEqual({'count': 0, 'mean': None, 'p50': None, 'p99': None, 'max': 0.0}, histogram.snapshot())
+
+    def test_percentiles(self):
+        histogram = stats.Histogram(bounds=[1, 2, 4, 8])
+        for value in (0.5, 0.5, 1.5, 3, 3, 3, 7, 7, 7, 20):
+            histogram.add(value)
+        self.assertEqual(10, histogram.count)
+        self.assertEqual([2, 1, 3, 3, 1], histogram.counts)
+        self.assertEqual(4, histogram.percentile(0.5))
+        self.assertEqual(20, histogram.percentile(0.99))
+        self.assertEqual(20, histogram.max)
+
+    def test_weight(self):
+        histogram = stats.Histogram(bounds=[1, 2])
+        histogram.add(1.5, weight=3)
+        self.assertEqual([0, 3, 0], histogram.counts)
+        self.assertEqual(4.5, histogram.total)
+
+
+class WatcherStatsTests(AIONotifyTestCase):
+
+    def test_disabled(self):
+        self.assertIsNone(self.watcher.stats)
+
+    async def test_counters(self):
+        """Reads, events and deliveries are counted."""
+        self.watcher = aionotify.Watcher(stats=True)
+        measures = []
+        self.watcher.stats.add_hook(lambda name, value: measures.append(name))
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        await self.watcher.setup(self.loop)
+
+        self._touch('a')
+        self._touch('b')
+        events = []
+        while len(events) < 2:
+            events.extend(await self.watcher.get_events())
+
+        snapshot = self.watcher.stats.snapshot()
+        self.assertEqual(2, snapshot['events'])
+        self.assertEqual(2, snapshot['delivered'])
+        self.assertGreaterEqual(snapshot['reads'], 1)
+        self.assertEqual(snapshot['bytes_read'], 2 * (aionotify.base.PREFIX.size + 16))
+        self.assertEqual(0, snapshot['queue_depth'])
+        self.assertEqual(2, snapshot['latency']['count'])
+        self.assertIn('read', measures)
+        self.assertIn('latency', measures)
+
+    async def test_unknown_watch(self):
+        """Events for removed watches are counted."""
+        self.watcher = aionotify.Watcher(stats=True)
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        await self.watcher.setup(self.loop)
+        self.watcher.unwatch(self.testdir)
+
+        # The kernel sends IGNORED for the removed watch.
+        self.assertEqual([], await self.watcher.get_events(timeout=0.1))
+        self.assertEqual(1, self.watcher.stats.unknown_watch)
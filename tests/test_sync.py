@@ -0,0 +1,118 @@
+# Copyright (c) 2016 The aionotify project
+# This code is distributed under the two-clause BSD License.
+
+import os
+import tempfile
+import threading
+import unittest
+
+import aionotify
+
+from .test_usage import TESTDIR
+
+
+class SyncWatcherTests(unittest.TestCase):
+
+    def setUp(self):
+        self._testdir = tempfile.TemporaryDirectory(dir=TESTDIR)
+        self.testdir = self._testdir.name
+        self.watcher = aionotify.SyncWatcher()
+
+    def tearDown(self):
+        self.watcher.close()
+        self._testdir.cleanup()
+
+    def _touch(self, filename):
+        with open(os.path.join(self.testdir, filename), 'w'):
+            pass
+
+    def test_read_events(self):
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        self.watcher.setup()
+        self._touch('a')
+        self._touch('b')
+
+        events = []
+        while len(events) < 2:
+            events.extend(self.watcher.read_events(timeout=1))
+        self.assertEqual(['a', 'b'], [event.name for event in events])
+        self.assertEqual({self.testdir}, {event.alias for event in events})
+
+    def test_watch_budget(self):
+        """Directories beyond max_watches are polled while waiting for events."""
+        self.watcher = aionotify.SyncWatcher(max_watches=1)
+        self.watcher.poll_interval = 0.05
+        os.mkdir(os.path.join(self.testdir, 'a'))
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE, recursive=True)
+        self.watcher.setup()
+        self.assertEqual({(self.testdir, 'a')}, set(self.watcher._polled))
+
+        self._touch('a/f')
+        events = self.watcher.read_events(timeout=1)
+        self.assertEqual(['a/f'], [event.name for event in events])
+
+    def test_refreshed_snapshots(self):
+        """Snapshots of directories with events are refreshed while waiting for events."""
+        self.watcher = aionotify.SyncWatcher(rescan_on_overflow=True)
+        self.watcher.refresh_interval = 0.05
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        self.watcher.setup()
+        self._touch('a')
+        self.assertEqual(['a'], [event.name for event in self.watcher.read_events(timeout=1)])
+        self.assertEqual([], self.watcher.read_events(timeout=0.2))
+        self.assertEqual(['a'], list(self.watcher._snapshots[self.watcher.descriptors[self.testdir]]))
+
+    def test_timeout(self):
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        self.watcher.setup()
+        self.assertEqual([], self.watcher.read_events(timeout=0.05))
+
+    def test_max_events(self):
+        self.watcher.setup()
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        self._touch('a')
+        self._touch('b')
+        self.assertEqual(['a'], [event.name for event in self.watcher.read_events(timeout=1, max_events=1)])
+        self.assertEqual(['b'], [event.name for event in self.watcher.read_events(timeout=1)])
+
+    def test_stages(self):
+        """Processing stages are shared with the asyncio Watcher."""
+        self.watcher = aionotify.SyncWatcher(rename_window=0.05)
+        self.watcher.watch(self.testdir, aionotify.Flags.MOVED_FROM | aionotify.Flags.MOVED_TO)
+        self._touch('a')
+        self.watcher.setup()
+        os.rename(os.path.join(self.testdir, 'a'), os.path.join(self.testdir, 'b'))
+
+        event, = self.watcher.read_events(timeout=1)
+        self.assertEqual(('a', 'b'), (event.src_name, event.dst_name))
+
+    def test_recursive(self):
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE, recursive=True)
+        with self.watcher:
+            os.mkdir(os.path.join(self.testdir, 'sub'))
+            self.assertEqual(['sub'], [event.name for event in self.watcher.read_events(timeout=1)])
+            self._touch(os.path.join('sub', 'a'))
+            self.assertEqual([os.path.join('sub', 'a')], [event.name for event in self.watcher.read_events(timeout=1)])
+        self.assertTrue(self.watcher.closed)
+
+    def test_thread(self):
+        """A watcher runs in a plain thread."""
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        self.watcher.setup()
+        received = []
+        thread = threading.Thread(target=lambda: received.extend(self.watcher.read_events(timeout=1)))
+        thread.start()
+        self._touch('a')
+        thread.join()
+        self.assertEqual(['a'], [event.name for event in received])
+
+    def test_watch_many(self):
+        self.watcher.setup()
+        errors = self.watcher.watch_many([
+            (self.testdir, aionotify.Flags.CREATE, 'ok'),
+            (os.path.join(self.testdir, 'missing'), aionotify.Flags.CREATE, 'missing'),
+        ])
+        self.assertEqual(['missing'], list(errors))
+        self.assertIsInstance(errors['missing'], FileNotFoundError)
+        self.assertEqual(['ok'], list(self.watcher.requests))
+        self.assertEqual({}, self.watcher.unwatch_many(['ok']))
@@ -2,10 +2,14 @@
 # This code is distributed under the two-clause BSD License.
 
 import asyncio
+import importlib.metadata
 import logging
 import os
 import os.path
+import subprocess
+import sys
 import tempfile
+import time
 import unittest
 
 import aionotify
@@ -200,6 +204,827 @@ class SimpleUsageTests(AIONotifyTestCase):
         # And it's over.
         await self._assert_no_events()
 
+    async def test_undecodable_name(self):
+        """Names which are not valid UTF-8 are available as bytes."""
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        await self.watcher.setup(self.loop)
+
+        with open(os.path.join(os.fsencode(self.testdir), b'\xff.bin'), 'w'):
+            pass
+        event = await self.watcher.get_event()
+        self.assertEqual(b'\xff.bin', event.raw_name)
+        self.assertEqual(os.fsdecode(b'\xff.bin'), event.name)
+
+    async def test_close_while_waiting(self):
+        """Closing the watcher wakes up pending readers."""
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        await self.watcher.setup(self.loop)
+
+        task = asyncio.ensure_future(self.watcher.get_event())
+        await asyncio.sleep(0.05)
+        self.watcher.close()
+        event = await asyncio.wait_for(task, 1)
+        self.assertIsNone(event)
+
+    async def test_close_while_waiting_with_stages(self):
+        """Closing the watcher wakes up pending readers, even with processing stages."""
+        self.watcher = aionotify.Watcher(coalesce_window=0.05, rename_window=0.05, verify_content=True)
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        await self.watcher.setup(self.loop)
+
+        task = asyncio.ensure_future(self.watcher.get_event())
+        await asyncio.sleep(0.05)
+        self.watcher.close()
+        event = await asyncio.wait_for(task, 1)
+        self.assertIsNone(event)
+
+
+class BatchTests(AIONotifyTestCase):
+
+    async def test_get_events(self):
+        """All pending events are returned at once."""
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        await self.watcher.setup(self.loop)
+
+        for name in 'abc':
+            self._touch(name)
+        await asyncio.sleep(0.1)
+
+        events = await self.watcher.get_events()
+        self.assertEqual(3, len(events))
+        for event, name in zip(events, 'abc'):
+            self._assert_file_event(event, name)
+
+        # And it's over.
+        await self._assert_no_events()
+
+    async def test_get_events_max_events(self):
+        """Events beyond max_events are kept for later calls."""
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        await self.watcher.setup(self.loop)
+
+        for name in 'abc':
+            self._touch(name)
+        await asyncio.sleep(0.1)
+
+        events = await self.watcher.get_events(max_events=2)
+        self.assertEqual(['a', 'b'], [event.name for event in events])
+        event = await self.watcher.get_event()
+        self._assert_file_event(event, 'c')
+
+        # And it's over.
+        await self._assert_no_events()
+
+    async def test_get_events_timeout(self):
+        """An empty batch is returned on timeout."""
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        await self.watcher.setup(self.loop)
+
+        events = await self.watcher.get_events(timeout=0.1)
+        self.assertEqual([], events)
+
+    async def test_get_events_skips_removed_watches(self):
+        """Events for removed watches are swallowed."""
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        await self.watcher.setup(self.loop)
+
+        self._touch('a')
+        self.watcher.unwatch(self.testdir)
+
+        events = await self.watcher.get_events(timeout=0.1)
+        self.assertEqual([], events)
+
+    async def test_batches(self):
+        """Batches can be consumed with ``async for``."""
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        await self.watcher.setup(self.loop)
+
+        for name in 'abc':
+            self._touch(name)
+
+        names = []
+        async for events in self.watcher.batches():
+            names.extend(event.name for event in events)
+            if len(names) >= 3:
+                break
+        self.assertEqual(['a', 'b', 'c'], names)
+
+
+class ReadSizeTests(AIONotifyTestCase):
+
+    async def test_small_read_size(self):
+        """Events spanning several kernel reads are all decoded."""
+        self.watcher = aionotify.Watcher(read_size=aionotify.base.EVENT_MAX_SIZE)
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        await self.watcher.setup(self.loop)
+
+        names = ['file%02d' % i for i in range(40)]
+        for name in names:
+            self._touch(name)
+
+        received = []
+        while len(received) < len(names):
+            events = await self.watcher.get_events(timeout=1)
+            self.assertNotEqual([], events)
+            received.extend(event.name for event in events)
+        self.assertEqual(names, received)
+
+    def test_read_size_too_small(self):
+        with self.assertRaises(ValueError):
+            aionotify.Watcher(read_size=aionotify.base.EVENT_MAX_SIZE - 1)
+
+
+class RecursiveTests(AIONotifyTestCase):
+
+    def _mkdir(self, dirname):
+        os.makedirs(os.path.join(self.testdir, dirname))
+
+    async def _wait_names(self, expected):
+        """Wait until events for all expected names were seen; duplicates are allowed."""
+        names = set()
+        while names != expected:
+            event = await asyncio.wait_for(self.watcher.get_event(), 1)
+            names.add(event.name)
+
+    async def test_existing_tree(self):
+        """Directories existing at setup time are watched."""
+        self._mkdir('a/b')
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE, recursive=True)
+        await self.watcher.setup(self.loop)
+
+        self._touch('a/b/f')
+        event = await self.watcher.get_event()
+        self._assert_file_event(event, 'a/b/f')
+
+        # And it's over.
+        await self._assert_no_events()
+
+    async def test_new_directory(self):
+        """Directories created after setup are watched, their content reported."""
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE, recursive=True)
+        await self.watcher.setup(self.loop)
+
+        self._mkdir('a/b')
+        self._touch('a/b/f')
+        await self._wait_names({'a', 'a/b', 'a/b/f'})
+
+        await asyncio.sleep(0.1)
+        self.watcher._protocol.events.clear()
+        self._touch('a/b/g')
+        event = await self.watcher.get_event()
+        self._assert_file_event(event, 'a/b/g')
+
+    async def test_moved_directory(self):
+        """Renamed directories are tracked under their new name."""
+        self._mkdir('a/b')
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE | aionotify.Flags.MOVED_TO, recursive=True)
+        await self.watcher.setup(self.loop)
+
+        self._rename('a', 'c')
+        event = await self.watcher.get_event()
+        self._assert_file_event(event, 'c', aionotify.Flags.MOVED_TO | aionotify.Flags.ISDIR)
+
+        self._touch('c/b/f')
+        event = await self.watcher.get_event()
+        self._assert_file_event(event, 'c/b/f')
+
+        # And it's over.
+        await self._assert_no_events()
+
+    async def test_renamed_directory_keeps_watches(self):
+        """Events on a renamed directory are not lost, even right after the rename."""
+        self._mkdir('c/b/d')
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE, recursive=True)
+        await self.watcher.setup(self.loop)
+        wds = set(self.watcher.aliases)
+
+        self._rename('c/b', 'c/b2')
+        self._touch('c/b2/y')
+        self._touch('c/b2/d/z')
+        await self._wait_names({'c/b2/y', 'c/b2/d/z'})
+
+        # The same kernel watches were kept, under their new paths.
+        self.assertEqual(wds, set(self.watcher.aliases))
+        self.assertEqual({'', 'c', 'c/b2', 'c/b2/d'}, set(self.watcher._trees[self.testdir]))
+        self.assertEqual({'', 'c', 'c/b2', 'c/b2/d'}, set(self.watcher._subdirs.values()))
+
+    async def test_directory_moved_out(self):
+        """Directories moved out of the tree are no longer watched."""
+        self._mkdir('a/b')
+        outside = tempfile.TemporaryDirectory(dir=TESTDIR)
+        self.addCleanup(outside.cleanup)
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE, recursive=True)
+        await self.watcher.setup(self.loop)
+
+        os.rename(os.path.join(self.testdir, 'a'), os.path.join(outside.name, 'a'))
+        self._touch('f')
+        event = await self.watcher.get_event()
+        self._assert_file_event(event, 'f')
+        self.assertEqual({''}, set(self.watcher._trees[self.testdir]))
+        self.assertEqual({}, self.watcher._moves)
+
+        self._touch('g', parent=os.path.join(outside.name, 'a', 'b'))
+        await self._assert_no_events()
+
+    async def test_directory_moved_out_same_read(self):
+        """Events following a move out of the tree in the same read are not reported under the tree."""
+        self._mkdir('a/b')
+        outside = tempfile.TemporaryDirectory(dir=TESTDIR)
+        self.addCleanup(outside.cleanup)
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE, recursive=True)
+        await self.watcher.setup(self.loop)
+
+        os.rename(os.path.join(self.testdir, 'a'), os.path.join(outside.name, 'a'))
+        self._touch('g', parent=os.path.join(outside.name, 'a', 'b'))
+        self._touch('f')
+        events = await self.watcher.get_events()
+        self.assertEqual(['f'], [event.name for event in events])
+        self.assertEqual({''}, set(self.watcher._trees[self.testdir]))
+
+    async def test_removed_directory(self):
+        """Watches on removed directories are dropped."""
+        self._mkdir('a')
+        self.watcher.watch(self.testdir, aionotify.Flags.DELETE, recursive=True)
+        await self.watcher.setup(self.loop)
+
+        os.rmdir(os.path.join(self.testdir, 'a'))
+        event = await self.watcher.get_event()
+        self._assert_file_event(event, 'a', aionotify.Flags.DELETE | aionotify.Flags.ISDIR)
+
+        # Internal flags and IGNORED events are not reported.
+        await self._assert_no_events()
+        self.assertEqual({''}, set(self.watcher._trees[self.testdir]))
+        self.assertEqual(1, len(self.watcher.aliases))
+
+    async def test_unwatch(self):
+        self._mkdir('a')
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE, recursive=True)
+        await self.watcher.setup(self.loop)
+
+        self.watcher.unwatch(self.testdir)
+        self._touch('a/f')
+        await self._assert_no_events()
+        self.assertEqual({}, self.watcher.aliases)
+
+
+class WatchBudgetTests(AIONotifyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.watcher = aionotify.Watcher(max_watches=2)
+        self.watcher.poll_interval = 0.05
+        for dirname in 'abc':
+            os.mkdir(os.path.join(self.testdir, dirname))
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE, recursive=True)
+
+    def _watched(self):
+        return set(self.watcher._trees[self.testdir])
+
+    def _polled(self):
+        return {relpath for _alias, relpath in self.watcher._polled}
+
+    async def test_polled_directories(self):
+        """Directories beyond the budget are polled, and watched again once active."""
+        await self.watcher.setup(self.loop)
+        self.assertEqual(2, len(self.watcher.aliases))
+        [watched] = self._watched() - {''}
+        polled = self._polled()
+        self.assertEqual({'a', 'b', 'c'}, polled | {watched})
+
+        target = sorted(polled)[0]
+        self._touch('f', parent=os.path.join(self.testdir, target))
+        event = await asyncio.wait_for(self.watcher.get_event(), 1)
+        self._assert_file_event(event, target + '/f')
+
+        # The least recently active watch made room for it.
+        self.assertEqual({'', target}, self._watched())
+        self.assertEqual({'a', 'b', 'c'} - {target}, self._polled())
+        self.assertEqual(2, len(self.watcher.aliases))
+
+        self._touch('g', parent=os.path.join(self.testdir, target))
+        event = await self.watcher.get_event()
+        self._assert_file_event(event, target + '/g')
+
+    async def test_new_directory(self):
+        """New directories get watched, evicting the least recently active one."""
+        await self.watcher.setup(self.loop)
+        [evicted] = self._watched() - {''}
+
+        os.mkdir(os.path.join(self.testdir, 'd'))
+        event = await self.watcher.get_event()
+        self._assert_file_event(event, 'd', aionotify.Flags.CREATE | aionotify.Flags.ISDIR)
+        # Polled once the IGNORED record of its watch is read.
+        while evicted not in self._polled():
+            await asyncio.sleep(0.01)
+        self.assertEqual({'', 'd'}, self._watched())
+
+    async def test_evicted_pending_events(self):
+        """Events already queued for an evicted directory are still delivered."""
+        self.watcher = aionotify.Watcher(max_watches=2)
+        self.watcher.poll_interval = 0.05
+        for dirname in 'bc':
+            os.rmdir(os.path.join(self.testdir, dirname))
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE, recursive=True)
+        await self.watcher.setup(self.loop)
+        self.assertEqual({'', 'a'}, self._watched())
+
+        os.mkdir(os.path.join(self.testdir, 'c'))
+        self._touch('x', parent=os.path.join(self.testdir, 'a'))
+        events = []
+        while len(events) < 2:
+            events.extend(await asyncio.wait_for(self.watcher.get_events(), 1))
+        self.assertEqual(['c', 'a/x'], [event.name for event in events])
+        while 'a' not in self._polled():
+            await asyncio.sleep(0.01)
+        self.assertEqual({'', 'c'}, self._watched())
+        self.assertEqual({'a'}, self._polled())
+        self.assertEqual(2, len(self.watcher.aliases))
+
+        # Later changes are found by polling.
+        self._touch('y', parent=os.path.join(self.testdir, 'a'))
+        event = await asyncio.wait_for(self.watcher.get_event(), 1)
+        self._assert_file_event(event, 'a/y')
+
+    async def test_unwatch(self):
+        await self.watcher.setup(self.loop)
+        self.watcher.unwatch(self.testdir)
+        self.assertEqual({}, self.watcher._polled)
+
+
+class CoalesceTests(AIONotifyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.watcher = aionotify.Watcher(coalesce_window=0.1)
+
+    def _write(self, filename, content):
+        with open(os.path.join(self.testdir, filename), 'a') as f:
+            f.write(content)
+
+    async def test_coalesce(self):
+        """Bursts of events on the same name are merged."""
+        self.watcher.watch(self.testdir, aionotify.Flags.MODIFY | aionotify.Flags.CLOSE_WRITE)
+        await self.watcher.setup(self.loop)
+
+        for i in range(10):
+            self._write('a', 'line %d\n' % i)
+        self._write('b', 'line')
+
+        events = await self.watcher.get_events(timeout=1)
+        self.assertEqual(2, len(events))
+        self._assert_file_event(events[0], 'a', aionotify.Flags.MODIFY | aionotify.Flags.CLOSE_WRITE)
+        self._assert_file_event(events[1], 'b', aionotify.Flags.MODIFY | aionotify.Flags.CLOSE_WRITE)
+
+        # And it's over.
+        await self._assert_no_events(timeout=0.2)
+
+    async def test_timeout(self):
+        """Held events are not delivered before the window closes."""
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        await self.watcher.setup(self.loop)
+
+        self._touch('a')
+        self.assertEqual([], await self.watcher.get_events(timeout=0.02))
+        event = await self.watcher.get_event()
+        self._assert_file_event(event, 'a')
+
+    async def test_unwatch(self):
+        """Held events are dropped when their watch is removed."""
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        await self.watcher.setup(self.loop)
+
+        self._touch('a')
+        self.assertEqual([], await self.watcher.get_events(timeout=0.02))
+        self.watcher.unwatch(self.testdir)
+        await self._assert_no_events(timeout=0.2)
+
+
+class RenamePairingTests(AIONotifyTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.watcher = aionotify.Watcher(rename_window=0.05)
+
+    async def test_rename(self):
+        """Renames are delivered as a single event."""
+        self.watcher.watch(self.testdir, aionotify.Flags.MOVED_FROM | aionotify.Flags.MOVED_TO)
+        await self.watcher.setup(self.loop)
+        self._touch('a')
+
+        self._rename('a', 'b')
+        event = await self.watcher.get_event()
+        self.assertIsInstance(event, aionotify.Rename)
+        self.assertEqual((self.testdir, 'a', self.testdir, 'b'), event[:4])
+        self.assertEqual(aionotify.Flags.MOVED_FROM | aionotify.Flags.MOVED_TO, event.flags)
+
+        # And it's over.
+        await self._assert_no_events()
+
+    async def test_move_out(self):
+        """Files moved out of watched directories come out as MOVED_FROM."""
+        os.mkdir(os.path.join(self.testdir, 'sub'))
+        self.watcher.watch(self.testdir, aionotify.Flags.MOVED_FROM)
+        await self.watcher.setup(self.loop)
+        self._touch('a')
+
+        self._rename('a', 'sub/a')
+        event = await self.watcher.get_event()
+        self._assert_file_event(event, 'a', aionotify.Flags.MOVED_FROM)
+
+
+class NameFilterTests(AIONotifyTestCase):
+
+    async def test_include(self):
+        """Only events matching the include patterns are delivered."""
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE, include='*.ready')
+        await self.watcher.setup(self.loop)
+
+        self._touch('a.tmp')
+        self._touch('a.ready')
+        event = await self.watcher.get_event()
+        self._assert_file_event(event, 'a.ready')
+
+        # And it's over.
+        await self._assert_no_events()
+        self.assertEqual({self.testdir: 1}, self.watcher.filtered)
+
+    async def test_exclude_recursive(self):
+        """Patterns apply to file names within recursive watches."""
+        os.mkdir(os.path.join(self.testdir, 'sub'))
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE, recursive=True, exclude='*.tmp')
+        await self.watcher.setup(self.loop)
+
+        self._touch('sub/a.tmp')
+        self._touch('sub/b')
+        event = await self.watcher.get_event()
+        self._assert_file_event(event, 'sub/b')
+
+        # And it's over.
+        await self._assert_no_events()
+        self.assertEqual({self.testdir: 1}, self.watcher.filtered)
+
+
+class BulkWatchTests(AIONotifyTestCase):
+
+    def _mkdirs(self, names):
+        for name in names:
+            os.mkdir(os.path.join(self.testdir, name))
+        return [(os.path.join(self.testdir, name), aionotify.Flags.CREATE, name) for name in names]
+
+    async def test_watch_many(self):
+        """Watches can be added in bulk, errors are reported per alias."""
+        await self.watcher.setup(self.loop)
+        watches = self._mkdirs(['a', 'b'])
+        watches.append((os.path.join(self.testdir, 'nonexistent'), aionotify.Flags.CREATE, 'c'))
+
+        errors = await self.watcher.watch_many(watches)
+        self.assertEqual(['c'], list(errors))
+        self.assertIsInstance(errors['c'], FileNotFoundError)
+        self.assertEqual({'a', 'b'}, set(self.watcher.requests))
+
+        self._touch('f', parent=os.path.join(self.testdir, 'b'))
+        event = await self.watcher.get_event()
+        self._assert_file_event(event, 'f', alias='b')
+
+    async def test_watch_many_before_start(self):
+        errors = await self.watcher.watch_many(self._mkdirs(['a', 'b']))
+        self.assertEqual({}, errors)
+        await self.watcher.setup(self.loop)
+
+        self._touch('f', parent=os.path.join(self.testdir, 'a'))
+        event = await self.watcher.get_event()
+        self._assert_file_event(event, 'f', alias='a')
+
+    async def test_events_during_registration(self):
+        """Events read while their watch is being registered are delivered."""
+        await self.watcher.setup(self.loop)
+        watches = self._mkdirs(['a', 'b'])
+        add_watches = aionotify.base.LibC.add_watches
+
+        def slow_add_watches(fd, watches):
+            results = add_watches(fd, watches)
+            self._touch('f', parent=os.path.join(self.testdir, 'a'))
+            # Leave the event loop time to read the event.
+            time.sleep(0.1)
+            return results
+
+        aionotify.base.LibC.add_watches = slow_add_watches
+        self.addCleanup(setattr, aionotify.base.LibC, 'add_watches', add_watches)
+        self.assertEqual({}, await self.watcher.watch_many(watches))
+
+        event = await asyncio.wait_for(self.watcher.get_event(), 1)
+        self._assert_file_event(event, 'f', alias='a')
+
+    async def test_watch_many_duplicates(self):
+        """Errors for duplicates are keyed by their effective alias."""
+        path = self._mkdirs(['a'])[0][0]
+        errors = await self.watcher.watch_many([(path, aionotify.Flags.CREATE, None)] * 2)
+        self.assertEqual([path], list(errors))
+        self.assertIsInstance(errors[path], ValueError)
+
+    async def test_unwatch_many_before_start(self):
+        errors = await self.watcher.unwatch_many(['a'])
+        self.assertEqual(['a'], list(errors))
+
+    async def test_events_discarded_while_waiting(self):
+        """A reader woken up for events of a watch removed meanwhile keeps waiting."""
+        await self.watcher.setup(self.loop)
+        await self.watcher.watch_many(self._mkdirs(['a', 'b']))
+        reader = asyncio.ensure_future(self.watcher.get_events())
+        await asyncio.sleep(0)
+
+        self.watcher._protocol.feed_events([aionotify.Event(aionotify.Flags.CREATE, 0, b'x', 'a')])
+        self.watcher.unwatch('a')
+        self._touch('f', parent=os.path.join(self.testdir, 'b'))
+        events = await reader
+        self.assertEqual([('f', 'b')], [(event.name, event.alias) for event in events])
+
+    async def test_unwatch_many(self):
+        await self.watcher.setup(self.loop)
+        await self.watcher.watch_many(self._mkdirs(['a', 'b']))
+
+        errors = await self.watcher.unwatch_many(['a', 'b', 'c'])
+        self.assertEqual(['c'], list(errors))
+        self.assertEqual({}, self.watcher.descriptors)
+
+        self._touch('f', parent=os.path.join(self.testdir, 'a'))
+        await self._assert_no_events()
+
+
+class OverflowTests(AIONotifyTestCase):
+
+    async def _events_after_overflow(self):
+        """Read events until the queue is drained; return the (name, flags) seen after an overflow."""
+        overflowed = False
+        seen = set()
+        while True:
+            events = await self.watcher.get_events(timeout=0.5)
+            if not events:
+                break
+            for event in events:
+                if event.flags & aionotify.Flags.Q_OVERFLOW:
+                    self.assertIsNone(event.alias)
+                    overflowed = True
+                elif overflowed:
+                    seen.add((event.name, event.flags))
+        self.assertTrue(overflowed)
+        return seen
+
+    def _overflow(self):
+        """Feed an overflow record, as sent by the kernel."""
+        self.watcher._protocol.data_received(aionotify.base.PREFIX.pack(-1, aionotify.Flags.Q_OVERFLOW, 0, 0))
+
+    async def test_overflow_event(self):
+        """Overflows are reported."""
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        await self.watcher.setup(self.loop)
+
+        self._overflow()
+        event = await self.watcher.get_event()
+        self.assertEqual((aionotify.Flags.Q_OVERFLOW, 0, '', None), event)
+
+    async def test_rescan(self):
+        """Changes are recovered from a snapshot after an overflow."""
+        self.watcher = aionotify.Watcher(rescan_on_overflow=True)
+        self._touch('modified')
+        self._touch('deleted')
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE | aionotify.Flags.DELETE | aionotify.Flags.MODIFY)
+        await self.watcher.setup(self.loop)
+
+        with open(os.path.join(self.testdir, 'modified'), 'w') as f:
+            f.write('content')
+        self._unlink('deleted')
+        self._touch('created')
+
+        # Lose all those events.
+        await asyncio.sleep(0.1)
+        self.watcher._protocol.events.clear()
+        self._overflow()
+
+        self.assertEqual({
+            ('modified', aionotify.Flags.MODIFY),
+            ('deleted', aionotify.Flags.DELETE),
+            ('created', aionotify.Flags.CREATE),
+        }, await self._events_after_overflow())
+
+    async def test_refreshed_snapshots(self):
+        """Snapshots are refreshed after events, so changes already delivered are not reported again."""
+        self.watcher = aionotify.Watcher(rescan_on_overflow=True)
+        self.watcher.refresh_interval = 0.05
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        await self.watcher.setup(self.loop)
+        self._touch('a')
+        event = await self.watcher.get_event()
+        self._assert_file_event(event, 'a')
+        await asyncio.sleep(0.2)
+        # Keep the next events out of the snapshots.
+        self.watcher.refresh_interval = 60
+        await asyncio.sleep(0.1)
+
+        self._touch('b')
+        await asyncio.sleep(0.1)
+        self.watcher._protocol.events.clear()
+        self._overflow()
+        self.assertEqual({('b', aionotify.Flags.CREATE)}, await self._events_after_overflow())
+
+    async def test_refresh_pending_events(self):
+        """Snapshots are not refreshed while events wait in the kernel queue."""
+        self.watcher = aionotify.Watcher(rescan_on_overflow=True)
+        self.watcher.refresh_interval = 0.05
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        await self.watcher.setup(self.loop)
+        self._touch('a')
+        event = await self.watcher.get_event()
+        self._assert_file_event(event, 'a')
+
+        inotify_queued = aionotify.base.LibC.inotify_queued
+        self.addCleanup(setattr, aionotify.base.LibC, 'inotify_queued', inotify_queued)
+        aionotify.base.LibC.inotify_queued = classmethod(lambda cls, fd: 1)
+        await asyncio.sleep(0.2)
+        self._overflow()
+        self.assertEqual({('a', aionotify.Flags.CREATE)}, await self._events_after_overflow())
+
+    async def test_removed_subdirectory(self):
+        """Snapshots of subdirectory watches go away with them."""
+        self.watcher = aionotify.Watcher(rescan_on_overflow=True)
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE | aionotify.Flags.DELETE, recursive=True)
+        await self.watcher.setup(self.loop)
+        os.mkdir(os.path.join(self.testdir, 'sub'))
+        await self.watcher.get_event()
+        await asyncio.sleep(0.1)
+        self.assertEqual(2, len(self.watcher._snapshots))
+
+        os.rmdir(os.path.join(self.testdir, 'sub'))
+        await self.watcher.get_event()
+        await asyncio.sleep(0.1)
+        self.assertEqual(set(self.watcher.aliases), set(self.watcher._snapshots))
+        self.assertEqual(1, len(self.watcher._snapshots))
+
+
+class VerifyContentTests(AIONotifyTestCase):
+
+    async def test_unchanged_dropped(self):
+        """Closing a file without changing it doesn't produce an event."""
+        self.watcher = aionotify.Watcher(verify_content=True)
+        self.watcher.watch(self.testdir, aionotify.Flags.CLOSE_WRITE)
+        await self.watcher.setup(self.loop)
+
+        self._touch('a')
+        event = await self.watcher.get_event()
+        self._assert_file_event(event, 'a', aionotify.Flags.CLOSE_WRITE)
+
+        # Opened for writing, nothing written.
+        with open(os.path.join(self.testdir, 'a'), 'a'):
+            pass
+        self._touch('b')
+        event = await self.watcher.get_event()
+        self._assert_file_event(event, 'b', aionotify.Flags.CLOSE_WRITE)
+        await self._assert_no_events()
+
+
+class QueueTests(AIONotifyTestCase):
+
+    async def test_async_iterator(self):
+        """Events can be consumed with ``async for``."""
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        await self.watcher.setup(self.loop)
+        self._touch('a')
+        self._touch('b')
+
+        names = []
+        async for event in self.watcher:
+            names.append(event.name)
+            if len(names) == 2:
+                self.watcher.close()
+        self.assertEqual(['a', 'b'], names)
+
+    async def test_block(self):
+        """Once the queue is full, events are left in the kernel queue."""
+        self.watcher = aionotify.Watcher(read_size=aionotify.base.EVENT_MAX_SIZE, max_queue=4)
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        await self.watcher.setup(self.loop)
+
+        names = ['file%02d' % i for i in range(20)]
+        for name in names:
+            self._touch(name)
+        await asyncio.sleep(0.1)
+        self.assertLess(len(self.watcher._protocol.events), len(names))
+
+        received = []
+        while len(received) < len(names):
+            events = await self.watcher.get_events(max_events=3, timeout=1)
+            self.assertNotEqual([], events)
+            received.extend(event.name for event in events)
+        self.assertEqual(names, received)
+
+    async def test_drop_oldest(self):
+        self.watcher = aionotify.Watcher(max_queue=5, queue_policy='drop-oldest')
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        await self.watcher.setup(self.loop)
+
+        names = ['file%02d' % i for i in range(20)]
+        for name in names:
+            self._touch(name)
+        await asyncio.sleep(0.1)
+
+        events = await self.watcher.get_events()
+        self.assertEqual(names[-5:], [event.name for event in events])
+        self.assertEqual(15, self.watcher._protocol.dropped)
+
+    async def test_coalesce(self):
+        self.watcher = aionotify.Watcher(max_queue=2, queue_policy='coalesce')
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE | aionotify.Flags.CLOSE_WRITE)
+        await self.watcher.setup(self.loop)
+
+        for _i in range(5):
+            self._touch('a')
+        await asyncio.sleep(0.1)
+
+        events = await self.watcher.get_events()
+        self.assertEqual(1, len(events))
+        self._assert_file_event(events[0], 'a', aionotify.Flags.CREATE | aionotify.Flags.CLOSE_WRITE)
+
+    def test_invalid_policy(self):
+        with self.assertRaises(ValueError):
+            aionotify.Watcher(max_queue=2, queue_policy='ignore')
+
+
+class TracingTests(AIONotifyTestCase):
+
+    async def test_timestamps(self):
+        """Events carry the time of their read; trace hooks see it through read, decode and delivery."""
+        traces = []
+        self.watcher = aionotify.Watcher(timestamps=True, trace=lambda *args: traces.append(args))
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        await self.watcher.setup(self.loop)
+
+        before = time.monotonic()
+        self._touch('a')
+        event = await self.watcher.get_event()
+        self._assert_file_event(event, 'a')
+        self.assertLessEqual(before, event.timestamp)
+        self.assertLessEqual(event.timestamp, time.monotonic())
+
+        self.assertEqual(['read', 'decode', 'deliver'], [stage for stage, _now, _value in traces])
+        (_read, read_at, nbytes), (_decode, decoded_at, decoded), (_deliver, delivered_at, delivered) = traces
+        self.assertEqual(event.timestamp, read_at)
+        self.assertGreater(nbytes, 0)
+        self.assertEqual([event], decoded)
+        self.assertEqual([event], delivered)
+        self.assertLessEqual(read_at, decoded_at)
+        self.assertLessEqual(decoded_at, delivered_at)
+
+    async def test_coalesced(self):
+        """Merged events keep the timestamp of the first one."""
+        self.watcher = aionotify.Watcher(timestamps=True, coalesce_window=0.05)
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE | aionotify.Flags.CLOSE_WRITE)
+        await self.watcher.setup(self.loop)
+
+        self._touch('a')
+        event = await self.watcher.get_event()
+        self._assert_file_event(event, 'a', aionotify.Flags.CREATE | aionotify.Flags.CLOSE_WRITE)
+        self.assertIsNotNone(event.timestamp)
+
+    async def test_disabled(self):
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        await self.watcher.setup(self.loop)
+        self._touch('a')
+        event = await self.watcher.get_event()
+        self.assertIsNone(event.timestamp)
+
+
+class LibCTests(unittest.TestCase):
+
+    def test_init_flags(self):
+        """The inotify fd is non-blocking, and not inherited by child processes."""
+        fd = aionotify.base.LibC.inotify_init()
+        try:
+            self.assertFalse(os.get_blocking(fd))
+            self.assertFalse(os.get_inheritable(fd))
+            with self.assertRaises(BlockingIOError):
+                os.read(fd, aionotify.base.EVENT_MAX_SIZE)
+        finally:
+            os.close(fd)
+
+    def test_init_error(self):
+        with self.assertRaises(OSError):
+            aionotify.base.LibC.inotify_init(-1)
+
+
+class ImportTests(unittest.TestCase):
+
+    def test_lazy_imports(self):
+        """Importing aionotify loads neither libc nor the installed distributions' metadata."""
+        modules = ['ctypes', 'importlib.metadata', 'hashlib', 'json']
+        code = "import sys, aionotify; print(' '.join(m for m in %r if m in sys.modules))" % modules
+        output = subprocess.check_output([sys.executable, '-c', code], cwd=os.path.dirname(os.path.dirname(__file__)))
+        self.assertEqual('', output.decode().strip())
+
+    def test_version(self):
+        self.assertEqual(importlib.metadata.version('aionotify'), aionotify.__version__)
+        with self.assertRaises(AttributeError):
+            aionotify.nonexistent
+
 
 class ErrorTests(AIONotifyTestCase):
     """Test error cases."""
@@ -211,6 +1036,22 @@ class ErrorTests(AIONotifyTestCase):
         with self.assertRaises(OSError):
             await self.watcher.setup(self.loop)
 
+    async def test_watch_nonexistent_after_start(self):
+        """Errors of a watch added once started carry their errno and path."""
+        await self.watcher.setup(self.loop)
+        badpath = os.path.join(self.testdir, 'nonexistent')
+        with self.assertRaises(FileNotFoundError) as cm:
+            self.watcher.watch(badpath, aionotify.Flags.CREATE)
+        self.assertEqual(badpath, cm.exception.filename)
+
+    async def test_unwatch_removed(self):
+        """Removing a watch already dropped by the kernel raises an OSError."""
+        self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
+        await self.watcher.setup(self.loop)
+        aionotify.base.LibC.inotify_rm_watch(self.watcher._fd, self.watcher.descriptors[self.testdir])
+        with self.assertRaises(OSError):
+            self.watcher.unwatch(self.testdir)
+
     async def test_unwatch_bad_alias(self):
         self.watcher.watch(self.testdir, aionotify.Flags.CREATE)
         await self.watcher.setup(self.loop)